@@ -11,17 +11,35 @@ dynamic rules management, anti-spam, and extensive moderation features.
 """
 
 import os
+import sys
 import json
 import asyncio
 import logging
+import logging.handlers
 import re
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Any, Set
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Any, Set, Iterable, Iterator, Tuple, Union
 import random
 import hashlib
 import time
+import tempfile
+import threading
+import sqlite3
+import struct
+import unicodedata
+import queue
+import mmap
+import math
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from urllib.parse import urlparse
+from functools import lru_cache
+from itertools import islice
 
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup, 
@@ -34,24 +52,486 @@ from telegram.ext import (
 from telegram.constants import ParseMode, ChatMemberStatus, MessageEntityType
 from telegram.error import TelegramError, Forbidden, BadRequest
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('data/bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def setup_logging(log_dir: Path = Path("data")) -> logging.handlers.QueueListener:
+    """Route log records through a queue to a rotating file and the console.
+
+    Handlers only enqueue records; the actual I/O happens on the listener's
+    thread. LOG_LEVEL and LOG_FORMAT come from the environment, and the log
+    file rotates at LOG_MAX_BYTES keeping LOG_BACKUP_COUNT old files.
+    """
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    formatter = logging.Formatter(
+        os.getenv('LOG_FORMAT', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+
+    log_dir.mkdir(exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_dir / 'bot.log',
+        maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+        backupCount=int(os.getenv('LOG_BACKUP_COUNT', 3)),
+        encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
+    )
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(getattr(logging, level, logging.INFO))
+
+    listener.start()
+    return listener
+
+# Characters that render as nothing and are used to split up banned words
+ZERO_WIDTH_CHARS = dict.fromkeys(map(ord, '\u00ad\u034f\u180e\u200b\u200c\u200d\u200e\u200f\u2060\u2061\u2062\u2063\u2064\ufeff'))
+
+# Cyrillic and Greek letters that look like Latin ones
+CONFUSABLES = str.maketrans(
+    'аеорсхуіјѕкмтвнԁһӏѵ' 'αοειкνρτυχβ',
+    'aeopcxyijskmtbhdhlv' 'aoeikvptuxb'
+)
+
+LEETSPEAK = str.maketrans('0134578@$', 'oieastbas')
+
+# Runs like "s.e.x", "p-o-r-n" or "f u c k": three or more single characters
+# joined by a single separator
+SPACED_LETTERS_PATTERN = re.compile(r'(?<![^\W_])(?:[^\W_]|[@$])(?:(?:[^\w@$]|_)(?:[^\W_]|[@$])){2,}(?![^\W_])')
+SEPARATOR_PATTERN = re.compile(r'[^\w@$]|_')
+# Words containing at least one character that leetspeak substitutes
+LEET_TOKEN_PATTERN = re.compile(r'(?:[^\W_]|[@$])*[0-9@$](?:[^\W_]|[@$])*')
+# Every run of digits/symbols sits between letters, as in "sh1t" or "a$$hole"
+LEET_INTERIOR_PATTERN = re.compile(r'(?:[^\W\d_]+[0-9@$]+)+[^\W\d_]+')
+
+def _unleet(match: "re.Match") -> str:
+    """Map leetspeak only in words that read as disguised words.
+
+    Tokens led by a digit ("5ex", "10am") and codes where digits are not
+    between letters and letters are not the majority ("A55", "D13", "MH17")
+    are numbers or product names and stay as they are.
+    """
+    token = match.group()
+    if token.isalpha() or token[0].isdigit():
+        return token
+    letters = sum(1 for c in token if c.isalpha())
+    if letters * 2 > len(token) or LEET_INTERIOR_PATTERN.fullmatch(token):
+        return token.translate(LEETSPEAK)
+    return token
+
+@lru_cache(maxsize=4096)
+def normalize_text(text: str) -> str:
+    """Fold a message into the canonical form used for keyword matching.
+
+    Applies NFKC, strips zero-width characters and diacritics, folds
+    confusable letters, joins letters split by separators, maps leetspeak
+    inside words and collapses whitespace. Cached, so every check on the
+    same message shares one normalization.
+    """
+    text = unicodedata.normalize('NFKC', text).translate(ZERO_WIDTH_CHARS).casefold()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFD', text) if not unicodedata.combining(c))
+        text = text.translate(CONFUSABLES)
+    text = SPACED_LETTERS_PATTERN.sub(lambda m: SEPARATOR_PATTERN.sub('', m.group()), text)
+    text = LEET_TOKEN_PATTERN.sub(_unleet, text)
+    return ' '.join(text.split())
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds every keyword of every category in one pass.
+
+    Keywords match whole words only; a trailing '*' (e.g. "fuck*") also
+    matches words that start with the keyword.
+    """
+
+    def __init__(self, categories: Dict[str, List[str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Per state: (category, keyword, keyword length, insertion order, prefix) ending here
+        self._out: List[List[Tuple[str, str, int, int, bool]]] = [[]]
+
+        order = 0
+        for category, keywords in categories.items():
+            for keyword in keywords:
+                prefix = keyword.endswith('*')
+                keyword = normalize_text(keyword.rstrip('*'))
+                if keyword:
+                    self._insert(category, keyword, order, prefix)
+                    order += 1
+        self._build_links()
+
+    def _insert(self, category: str, keyword: str, order: int, prefix: bool) -> None:
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append((category, keyword, len(keyword), order, prefix))
+
+    def _build_links(self) -> None:
+        # Breadth-first so every state's fail target is finished before it
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in self._goto[state].items():
+                pending.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str, str, int]]:
+        """Yield (start, end, category, keyword, order) for every whole-word
+        occurrence in already normalized text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        last = len(text) - 1
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for category, keyword, length, order, prefix in out[state]:
+                start = index + 1 - length
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if not prefix and index < last and text[index + 1].isalnum():
+                    continue
+                yield start, index + 1, category, keyword, order
+
+    def find(self, text: str) -> Dict[str, List[str]]:
+        """Return matched keywords per category, in keyword-list order"""
+        hits: Dict[Tuple[str, str], int] = {}
+        for _, _, category, keyword, order in self.iter_matches(text):
+            hits.setdefault((category, keyword), order)
+
+        found: Dict[str, List[str]] = {}
+        for (category, keyword), _ in sorted(hits.items(), key=lambda item: item[1]):
+            found.setdefault(category, []).append(keyword)
+        return found
+
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+def extract_urls(message: Message) -> List[str]:
+    """Collect the URLs in a message from the entities Telegram already parsed.
+
+    Covers visible links and hidden TEXT_LINK targets in both text and
+    captions. Only plain text that arrived without any entities is scanned
+    with the regex.
+    """
+    urls = []
+    for entities, parse in ((message.entities, message.parse_entity),
+                            (message.caption_entities, message.parse_caption_entity)):
+        for entity in entities or ():
+            if entity.type == MessageEntityType.URL:
+                urls.append(parse(entity))
+            elif entity.type == MessageEntityType.TEXT_LINK and entity.url:
+                urls.append(entity.url)
+
+    if not message.entities and message.text:
+        urls.extend(URL_PATTERN.findall(message.text))
+    if not message.caption_entities and message.caption:
+        urls.extend(URL_PATTERN.findall(message.caption))
+    return urls
+
+def normalize_domain(domain: str) -> str:
+    """Reduce a domain or URL to a bare lowercase host name"""
+    domain = domain.strip().lower()
+    if '://' in domain:
+        domain = urlparse(domain).netloc
+    domain = domain.split('/')[0].split('@')[-1].split(':')[0].strip('.')
+    return domain[4:] if domain.startswith('www.') else domain
+
+class DomainTrie:
+    """Suffix trie over reversed domain labels.
+
+    "bit.ly" is stored under ly -> bit, so a lookup walks the host's labels
+    from the TLD down and returns the verdict of the most specific listed
+    parent. Subdomains match their parent; look-alikes such as
+    "notbit.ly.example" do not.
+    """
+
+    # Verdict kinds in order of precedence when listed at the same domain
+    ALLOW, BLOCK, CATEGORY = 0, 1, 2
+    _VERDICT = '\0'
+
+    def __init__(self):
+        self._root: Dict[str, Any] = {}
+        self.size = 0
+
+    def add(self, domain: str, kind: int, label: Optional[str] = None) -> None:
+        domain = normalize_domain(domain)
+        if not domain:
+            return
+        node = self._root
+        for part in reversed(domain.split('.')):
+            node = node.setdefault(part, {})
+        current = node.get(self._VERDICT)
+        if current is None:
+            self.size += 1
+        if current is None or kind < current[0]:
+            node[self._VERDICT] = (kind, label)
+
+    def lookup(self, host: str) -> Tuple[int, Optional[Tuple[int, Optional[str]]]]:
+        """Return (depth, verdict) of the most specific listed suffix of host"""
+        node = self._root
+        best: Tuple[int, Optional[Tuple[int, Optional[str]]]] = (0, None)
+        depth = 0
+        for part in reversed(host.split('.')):
+            node = node.get(part)
+            if node is None:
+                break
+            depth += 1
+            verdict = node.get(self._VERDICT)
+            if verdict is not None:
+                best = (depth, verdict)
+        return best
+
+    def __len__(self) -> int:
+        return self.size
+
+class DomainBlocklist:
+    """Large domain blocklists held as memory-mapped Bloom filters.
+
+    Every ``*.txt`` file in the source directory is one category named
+    after the file ("phishing.txt" -> "phishing"), with one domain per line
+    or hosts-file lines ("0.0.0.0 example.com"). The lists are compiled
+    into a single binary file that is mapped read-only, so millions of
+    domains cost a few MB shared between processes instead of Python
+    strings. With ``exact`` a sorted array of 64-bit domain hashes is
+    stored too and confirms Bloom hits, removing false positives.
+    """
+
+    MAGIC = b'GMBLOOM1'
+    _HEADER = struct.Struct('<?I')        # exact, section count
+    _SECTION = struct.Struct('<QQIQQH')   # items, bits, hashes, bloom offset, exact offset, name length
+
+    def __init__(self, source_dir: Path, binary_path: Path,
+                 false_positive_rate: float = 0.001, exact: bool = False):
+        self.source_dir = source_dir
+        self.binary_path = binary_path
+        self.false_positive_rate = false_positive_rate
+        self.exact = exact
+        self._mmap: Optional[mmap.mmap] = None
+        self._file = None
+        self.sections: List[Tuple[str, int, int, int, int, Optional[memoryview]]] = []
+
+    @classmethod
+    def open(cls, binary_path: Path) -> "DomainBlocklist":
+        """Map an already built binary without looking at source files"""
+        blocklist = cls(binary_path.parent, binary_path)
+        blocklist._map()
+        return blocklist
+
+    def load(self) -> bool:
+        """Map the binary, rebuilding it first if the source lists changed.
+
+        Returns False when there are no source lists and no binary.
+        """
+        sources = sorted(self.source_dir.glob('*.txt')) if self.source_dir.is_dir() else []
+        if sources and self._is_stale(sources):
+            started = time.monotonic()
+            count = self.build(sources)
+            logger.info(f"Built domain blocklist: {count:,} domains in {time.monotonic() - started:.1f}s")
+        if not self.binary_path.exists():
+            return False
+        self._map()
+        return True
+
+    def _is_stale(self, sources: List[Path]) -> bool:
+        if not self.binary_path.exists():
+            return True
+        if max(source.stat().st_mtime for source in sources) > self.binary_path.stat().st_mtime:
+            return True
+        with open(self.binary_path, 'rb') as f:
+            head = f.read(len(self.MAGIC) + self._HEADER.size)
+        if len(head) < len(self.MAGIC) + self._HEADER.size or not head.startswith(self.MAGIC):
+            return True
+        exact, _ = self._HEADER.unpack_from(head, len(self.MAGIC))
+        if exact != self.exact:
+            return True
+        self._map()
+        stale = sorted(name for name, *_ in self.sections) != sorted(source.stem for source in sources)
+        self.close()
+        return stale
+
+    @staticmethod
+    def _read_domains(source: Path) -> Iterator[str]:
+        with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if not fields:
+                    continue
+                # Hosts-file format puts the address first
+                domain = normalize_domain(fields[1] if len(fields) > 1 else fields[0])
+                if '.' in domain:
+                    yield domain
+
+    @staticmethod
+    def _hashes(domain: str) -> Tuple[int, int]:
+        digest = hashlib.blake2b(domain.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return h1, h2 | 1
+
+    def build(self, sources: List[Path]) -> int:
+        """Compile source lists into the binary file; returns domains added"""
+        blooms = []
+        total = 0
+        for source in sources:
+            # Size from the line count so domain strings never pile up in memory
+            with open(source, 'rb') as f:
+                capacity = max(sum(1 for _ in f), 1)
+            bits = max(int(-capacity * math.log(self.false_positive_rate) / (math.log(2) ** 2)), 64)
+            hashes = max(1, round(bits / capacity * math.log(2)))
+            bloom = bytearray((bits + 7) // 8)
+            exact = array('Q') if self.exact else None
+            count = 0
+            for domain in self._read_domains(source):
+                h1, h2 = self._hashes(domain)
+                for i in range(hashes):
+                    bit = (h1 + i * h2) % bits
+                    bloom[bit >> 3] |= 1 << (bit & 7)
+                if exact is not None:
+                    exact.append(h1)
+                count += 1
+            if exact is not None:
+                exact = array('Q', sorted(set(exact)))
+            blooms.append((source.stem.encode('utf-8'), count, bits, hashes, bloom, exact))
+            total += count
+
+        # Header, section table, then the bit arrays and hash arrays (8-byte aligned)
+        table_size = sum(self._SECTION.size + len(name) for name, *_ in blooms)
+        offset = len(self.MAGIC) + self._HEADER.size + table_size
+        offset += -offset % 8
+        table, body = [], []
+        for name, count, bits, hashes, bloom, exact in blooms:
+            bloom_offset = offset
+            offset += len(bloom)
+            offset += -offset % 8
+            exact_offset = 0
+            if exact is not None:
+                exact_offset = offset
+                offset += len(exact) * 8
+            table.append(self._SECTION.pack(count, bits, hashes, bloom_offset, exact_offset, len(name)) + name)
+            body.append((bloom_offset, bytes(bloom)))
+            if exact is not None:
+                body.append((exact_offset, exact.tobytes()))
+
+        payload = bytearray(self.MAGIC + self._HEADER.pack(self.exact, len(blooms)) + b''.join(table))
+        for position, data in body:
+            payload.extend(b'\0' * (position - len(payload)))
+            payload.extend(data)
+
+        self.close()
+        self.binary_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.binary_path.parent, prefix=f".{self.binary_path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.binary_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return total
+
+    def _map(self) -> None:
+        self.close()
+        self._file = open(self.binary_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mmap
+        if mm[:len(self.MAGIC)] != self.MAGIC:
+            self.close()
+            raise ValueError(f"{self.binary_path} is not a domain blocklist")
+        position = len(self.MAGIC)
+        _, section_count = self._HEADER.unpack_from(mm, position)
+        position += self._HEADER.size
+        for _ in range(section_count):
+            count, bits, hashes, bloom_offset, exact_offset, name_length = self._SECTION.unpack_from(mm, position)
+            position += self._SECTION.size
+            name = mm[position:position + name_length].decode('utf-8')
+            position += name_length
+            exact = memoryview(mm)[exact_offset:exact_offset + count * 8].cast('Q') if exact_offset else None
+            self.sections.append((name, count, bits, hashes, bloom_offset, exact))
+
+    def lookup(self, host: str) -> Optional[str]:
+        """Category of the first list containing host or one of its parent domains"""
+        if self._mmap is None:
+            return None
+        mm = self._mmap
+        labels = host.split('.')
+        # Every suffix with at least two labels: a.b.example.com, b.example.com, example.com
+        for start in range(len(labels) - 1):
+            h1, h2 = self._hashes('.'.join(labels[start:]))
+            for name, count, bits, hashes, bloom_offset, exact in self.sections:
+                for i in range(hashes):
+                    bit = (h1 + i * h2) % bits
+                    if not mm[bloom_offset + (bit >> 3)] & (1 << (bit & 7)):
+                        break
+                else:
+                    if exact is None:
+                        return name
+                    index = bisect_left(exact, h1)
+                    if index < len(exact) and exact[index] == h1:
+                        return name
+        return None
+
+    def __len__(self) -> int:
+        return sum(count for _, count, *_ in self.sections)
+
+    def close(self) -> None:
+        for *_, exact in self.sections:
+            if exact is not None:
+                exact.release()
+        self.sections = []
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class GroupFilterRules:
+    """A group's banned words and domain lists, compiled for matching.
+
+    Only the group's own words are compiled; they are matched alongside the
+    shared global automaton, so group rules never go stale when the global
+    lists change.
+    """
+
+    __slots__ = ('serial', 'matcher', 'domains')
+
+    def __init__(self, serial: int, matcher: Optional[KeywordMatcher], domains: DomainTrie):
+        self.serial = serial  # unique per compilation, so edited lists never share cached verdicts
+        self.matcher = matcher
+        self.domains = domains
+
+def hash_text(text: str) -> int:
+    """Stable 64-bit hash of a string (unlike hash(), same across restarts)"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
 class ContentFilter:
     """Advanced content filtering system"""
     
     def __init__(self):
         self.adult_keywords = {
-            'explicit': ['porn', 'xxx', 'sex', 'nude', 'naked', 'nsfw', 'adult', 'erotic'],
-            'profanity': ['fuck', 'shit', 'bitch', 'damn', 'hell', 'ass', 'bastard'],
+            'explicit': ['porn*', 'xxx', 'sex', 'nude', 'naked', 'nsfw', 'adult', 'erotic'],
+            'profanity': ['fuck*', 'shit*', 'bitch*', 'damn', 'hell', 'ass', 'bastard'],
             'harassment': ['kill yourself', 'kys', 'die', 'suicide', 'hate you'],
             'spam_indicators': ['click here', 'free money', 'earn now', 'limited offer']
         }
@@ -61,9 +541,144 @@ class ContentFilter:
             'scam_sites': ['bit.ly', 'tinyurl.com'],  # Can be customized per group
             'social_media': ['onlyfans.com', 'telegram.me']
         }
+        
+        self._matcher: Optional[KeywordMatcher] = None
+        self._domain_trie: Optional[DomainTrie] = None
+        self.blocklist: Optional[DomainBlocklist] = None
+        
+        # Bumped whenever global rules change so compiled group rules go stale
+        self.rules_version = 0
+        self._group_rules: "OrderedDict[str, GroupFilterRules]" = OrderedDict()
+        self._group_rules_serial = 0
+        self.max_cached_groups = 1000
+        
+        # Verdicts for recently seen content; spam waves repeat the same text
+        self._verdicts: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self.max_cached_verdicts = 10000
+        self.verdict_hits = 0
+        self.verdict_misses = 0
+    
+    @property
+    def matcher(self) -> KeywordMatcher:
+        """Compiled keyword automaton, built on first use"""
+        if self._matcher is None:
+            self._matcher = KeywordMatcher(self.adult_keywords)
+        return self._matcher
+    
+    @property
+    def domain_trie(self) -> DomainTrie:
+        """Compiled suffix trie of the global domain categories"""
+        if self._domain_trie is None:
+            trie = DomainTrie()
+            for category, domains in self.suspicious_domains.items():
+                for domain in domains:
+                    trie.add(domain, DomainTrie.CATEGORY, category)
+            self._domain_trie = trie
+        return self._domain_trie
+    
+    def set_domains(self, category: str, domains: List[str]) -> None:
+        """Replace a domain category and recompile the trie"""
+        self.suspicious_domains[category] = list(domains)
+        self._domain_trie = None
+        self.rules_version += 1
+        self._verdicts.clear()
+    
+    def set_blocklist(self, blocklist: Optional[DomainBlocklist]) -> None:
+        """Swap in a (re)loaded bulk domain blocklist and close the old one.
+
+        Call from the thread that runs lookups (the event loop in the bot).
+        """
+        if self.blocklist is not None and self.blocklist is not blocklist:
+            self.blocklist.close()
+        self.blocklist = blocklist
+        self.rules_version += 1
+        self._verdicts.clear()
+    
+    def set_keywords(self, category: str, keywords: List[str]) -> None:
+        """Replace a keyword category and recompile the automaton"""
+        self.adult_keywords[category] = list(keywords)
+        self._matcher = None
+        self.rules_version += 1
+        self._verdicts.clear()
+    
+    def group_rules(self, chat_key: str, group: Dict) -> Optional[GroupFilterRules]:
+        """Compiled rules for a group, or None if it only uses the global lists"""
+        cached = self._group_rules.get(chat_key)
+        if cached is not None:
+            self._group_rules.move_to_end(chat_key)
+            return cached
+        
+        banned_words = group.get("banned_words", [])
+        allowed = group.get("allowed_domains", [])
+        blocked = group.get("blocked_domains", [])
+        if not (banned_words or allowed or blocked):
+            self._group_rules.pop(chat_key, None)
+            return None
+        
+        # A small automaton of just the group's words, scanned after the global one
+        matcher = KeywordMatcher({'banned': banned_words}) if banned_words else None
+        
+        domains = DomainTrie()
+        for domain in allowed:
+            domains.add(domain, DomainTrie.ALLOW)
+        for domain in blocked:
+            domains.add(domain, DomainTrie.BLOCK)
+        
+        self._group_rules_serial += 1
+        rules = GroupFilterRules(self._group_rules_serial, matcher, domains)
+        self._group_rules[chat_key] = rules
+        while len(self._group_rules) > self.max_cached_groups:
+            self._group_rules.popitem(last=False)
+        return rules
+    
+    def invalidate_group(self, chat_key: str) -> None:
+        """Drop a group's compiled rules after an admin edits its lists"""
+        self._group_rules.pop(chat_key, None)
+    
+    def invalidate_all_groups(self) -> None:
+        self._group_rules.clear()
+        self._verdicts.clear()
+    
+    def verdict_cache_stats(self) -> Dict[str, Any]:
+        """Size and hit rate of the verdict cache"""
+        lookups = self.verdict_hits + self.verdict_misses
+        return {
+            'size': len(self._verdicts),
+            'hits': self.verdict_hits,
+            'misses': self.verdict_misses,
+            'hit_rate': self.verdict_hits / lookups if lookups else 0.0
+        }
     
-    def check_content(self, text: str, check_adult=True, check_profanity=True, check_harassment=True) -> Dict:
-        """Comprehensive content analysis"""
+    def check_content(self, text: str, check_adult=True, check_profanity=True, check_harassment=True,
+                      normalized: Optional[str] = None, group_rules: Optional[GroupFilterRules] = None,
+                      urls: Optional[List[str]] = None, text_hash: Optional[int] = None) -> Dict:
+        """Comprehensive content analysis, served from the verdict cache for repeated content"""
+        if normalized is None:
+            normalized = normalize_text(text)
+        if text_hash is None:
+            text_hash = hash_text(normalized)
+        if urls is None:
+            urls = URL_PATTERN.findall(text)
+        
+        # Normalization lowercases and un-leets, so URLs are keyed separately
+        key = (text_hash, tuple(urls), check_adult, check_profanity, check_harassment,
+               self.rules_version, group_rules.serial if group_rules else 0)
+        cached = self._verdicts.get(key)
+        if cached is not None:
+            self._verdicts.move_to_end(key)
+            self.verdict_hits += 1
+        else:
+            self.verdict_misses += 1
+            cached = self._analyze(text, check_adult, check_profanity, check_harassment,
+                                   normalized, group_rules, urls)
+            self._verdicts[key] = cached
+            while len(self._verdicts) > self.max_cached_verdicts:
+                self._verdicts.popitem(last=False)
+        return {**cached, 'violations': list(cached['violations'])}
+    
+    def _analyze(self, text: str, check_adult: bool, check_profanity: bool, check_harassment: bool,
+                 normalized: str, group_rules: Optional[GroupFilterRules], urls: List[str]) -> Dict:
+        """Run every check against the message"""
         results = {
             'is_safe': True,
             'violations': [],
@@ -71,11 +686,15 @@ class ContentFilter:
             'suggested_action': 'none'
         }
         
-        text_lower = text.lower()
+        # One pass over the normalized text finds hits for every global
+        # category, a second (small) one finds the group's banned words
+        hits = self.matcher.find(normalized)
+        if group_rules is not None and group_rules.matcher is not None:
+            hits.update(group_rules.matcher.find(normalized))
         
         # Check adult content
         if check_adult:
-            adult_violations = self._check_category(text_lower, self.adult_keywords['explicit'])
+            adult_violations = hits.get('explicit', [])
             if adult_violations:
                 results['violations'].extend([f"Adult content: {v}" for v in adult_violations])
                 results['severity'] = 'high'
@@ -83,7 +702,7 @@ class ContentFilter:
         
         # Check profanity
         if check_profanity:
-            profanity_violations = self._check_category(text_lower, self.adult_keywords['profanity'])
+            profanity_violations = hits.get('profanity', [])
             if profanity_violations:
                 results['violations'].extend([f"Profanity: {v}" for v in profanity_violations])
                 if results['severity'] != 'high':
@@ -92,22 +711,30 @@ class ContentFilter:
         
         # Check harassment
         if check_harassment:
-            harassment_violations = self._check_category(text_lower, self.adult_keywords['harassment'])
+            harassment_violations = hits.get('harassment', [])
             if harassment_violations:
                 results['violations'].extend([f"Harassment: {v}" for v in harassment_violations])
                 results['severity'] = 'high'
                 results['suggested_action'] = 'ban'
         
         # Check spam indicators
-        spam_violations = self._check_category(text_lower, self.adult_keywords['spam_indicators'])
+        spam_violations = hits.get('spam_indicators', [])
         if spam_violations:
             results['violations'].extend([f"Spam: {v}" for v in spam_violations])
             if results['severity'] == 'low':
                 results['severity'] = 'medium'
                 results['suggested_action'] = 'delete'
         
+        # Check the group's own banned words
+        banned_violations = hits.get('banned', [])
+        if banned_violations:
+            results['violations'].extend([f"Banned word: {v}" for v in banned_violations])
+            if results['severity'] == 'low':
+                results['severity'] = 'medium'
+                results['suggested_action'] = 'delete'
+        
         # Check URLs
-        url_violations = self._check_urls(text)
+        url_violations = self._check_urls(text, group_rules, urls)
         if url_violations:
             results['violations'].extend(url_violations)
             results['severity'] = 'high'
@@ -116,121 +743,2020 @@ class ContentFilter:
         results['is_safe'] = len(results['violations']) == 0
         return results
     
-    def _check_category(self, text: str, keywords: List[str]) -> List[str]:
-        """Check text against keyword category"""
-        found = []
-        for keyword in keywords:
-            if keyword in text:
-                found.append(keyword)
-        return found
+    def domain_verdict(self, host: str, group_rules: Optional[GroupFilterRules] = None) -> Optional[Tuple[int, Optional[str]]]:
+        """Most specific verdict for a host across group and global lists.
+        
+        The deeper match wins; at equal depth the group's own lists win.
+        The bulk blocklist is only consulted when no list names the host.
+        """
+        depth, verdict = self.domain_trie.lookup(host)
+        if group_rules:
+            group_depth, group_verdict = group_rules.domains.lookup(host)
+            if group_verdict is not None and group_depth >= depth:
+                return group_verdict
+        if verdict is None and self.blocklist is not None:
+            category = self.blocklist.lookup(host)
+            if category is not None:
+                return (DomainTrie.CATEGORY, category)
+        return verdict
     
-    def _check_urls(self, text: str) -> List[str]:
-        """Check URLs in text for suspicious domains"""
+    def _check_urls(self, text: str, group_rules: Optional[GroupFilterRules] = None,
+                    urls: Optional[List[str]] = None) -> List[str]:
+        """Check URLs for suspicious domains (extracted from text if not given)"""
         violations = []
         
-        # Extract URLs using regex
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        urls = re.findall(url_pattern, text)
+        if urls is None:
+            urls = URL_PATTERN.findall(text)
         
         for url in urls:
             try:
+                # Entity URLs may come without a scheme ("example.com/page")
+                if '://' not in url:
+                    url = f"http://{url}"
                 domain = urlparse(url).netloc.lower()
-                
-                # Check against suspicious domains
-                for category, domains in self.suspicious_domains.items():
-                    if any(suspicious_domain in domain for suspicious_domain in domains):
-                        violations.append(f"Suspicious URL ({category}): {domain}")
+                verdict = self.domain_verdict(normalize_domain(domain), group_rules)
+                if verdict is None or verdict[0] == DomainTrie.ALLOW:
+                    continue
+                if verdict[0] == DomainTrie.BLOCK:
+                    violations.append(f"Blocked URL: {domain}")
+                else:
+                    violations.append(f"Suspicious URL ({verdict[1]}): {domain}")
                         
             except Exception:
                 continue
                 
         return violations
 
+# Per-process state for batch scanning; set by _init_batch_worker
+_batch_filter: Optional[ContentFilter] = None
+_batch_rules: Optional[GroupFilterRules] = None
+_batch_checks: Dict[str, bool] = {}
+
+def _init_batch_worker(rules: Dict[str, Any]) -> None:
+    """Build one ContentFilter per worker process from a rules dict.
+    
+    Recognised keys: "keywords" and "domains" (category -> list, replacing
+    the built-in category), "banned_words", "allowed_domains" and
+    "blocked_domains" (applied like a group's own lists), "blocklist" (path
+    of a built DomainBlocklist binary) and "checks" (check_adult /
+    check_profanity / check_harassment flags).
+    """
+    global _batch_filter, _batch_rules, _batch_checks
+    _batch_filter = ContentFilter()
+    _batch_filter.max_cached_verdicts = 50000
+    for category, keywords in rules.get("keywords", {}).items():
+        _batch_filter.set_keywords(category, keywords)
+    for category, domains in rules.get("domains", {}).items():
+        _batch_filter.set_domains(category, domains)
+    if rules.get("blocklist"):
+        _batch_filter.set_blocklist(DomainBlocklist.open(Path(rules["blocklist"])))
+    _batch_rules = _batch_filter.group_rules("batch", rules)
+    _batch_checks = {
+        "check_adult": rules.get("checks", {}).get("check_adult", True),
+        "check_profanity": rules.get("checks", {}).get("check_profanity", True),
+        "check_harassment": rules.get("checks", {}).get("check_harassment", True),
+    }
+
+def scan_batch(lines: List[Tuple[int, str]]) -> List[Dict]:
+    """Scan a chunk of JSONL lines; runs inside a worker process.
+    
+    Each line is an object with "text" and optionally "id" and "urls".
+    """
+    if _batch_filter is None:
+        _init_batch_worker({})
+    verdicts = []
+    for line_no, line in lines:
+        try:
+            record = json.loads(line)
+            text = record.get("text") or ""
+            result = _batch_filter.check_content(
+                text, group_rules=_batch_rules, urls=record.get("urls"), **_batch_checks
+            )
+        except (ValueError, AttributeError, TypeError) as e:
+            verdicts.append({"line": line_no, "error": str(e)})
+            continue
+        verdicts.append({
+            "line": line_no,
+            "id": record.get("id"),
+            "is_safe": result["is_safe"],
+            "severity": result["severity"],
+            "suggested_action": result["suggested_action"],
+            "violations": result["violations"]
+        })
+    return verdicts
+
+def scan_corpus(input_path: Path, output_path: Path, rules: Optional[Dict[str, Any]] = None,
+                workers: Optional[int] = None, chunk_size: int = 2000,
+                unsafe_only: bool = False) -> Dict[str, int]:
+    """Run the content filter over a JSONL corpus with a process pool.
+    
+    Lines are streamed in chunks with a bounded number in flight, and
+    verdicts are written as chunks complete, so output order follows
+    completion; use the "line" field to join back to the input.
+    """
+    totals = {"scanned": 0, "flagged": 0, "errors": 0}
+    workers = workers or os.cpu_count() or 1
+    
+    def write(out, verdicts: List[Dict]) -> None:
+        for verdict in verdicts:
+            totals["scanned"] += 1
+            if "error" in verdict:
+                totals["errors"] += 1
+            elif not verdict["is_safe"]:
+                totals["flagged"] += 1
+            elif unsafe_only:
+                continue
+            out.write(json.dumps(verdict, ensure_ascii=False) + "\n")
+    
+    with open(input_path, 'r', encoding='utf-8') as src, \
+            open(output_path, 'w', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                initargs=(rules or {},)) as pool:
+        pending = set()
+        chunk: List[Tuple[int, str]] = []
+        for line_no, line in enumerate(src, 1):
+            if not line.strip():
+                continue
+            chunk.append((line_no, line))
+            if len(chunk) < chunk_size:
+                continue
+            pending.add(pool.submit(scan_batch, chunk))
+            chunk = []
+            # Keep a couple of chunks queued per worker without reading the whole file
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(out, future.result())
+        if chunk:
+            pending.add(pool.submit(scan_batch, chunk))
+        for future in wait(pending).done:
+            write(out, future.result())
+    
+    return totals
+
+class MessageFeatures:
+    """Everything the filters need from a message, computed once per update"""
+
+    __slots__ = ('message_id', 'text', 'normalized', 'text_hash', 'length', 'caps_ratio', 'links',
+                 'media_type', 'media_id', 'forwarded', 'content_hash')
+
+    MEDIA_TYPES = ('photo', 'video', 'animation', 'document', 'sticker', 'voice', 'audio', 'video_note')
+    # Reposted by many people in normal conversation, so never treated as duplicated content
+    COMMON_MEDIA = ('sticker',)
+
+    def __init__(self, text: str, links: List[str], media_type: Optional[str] = None, message_id: int = 0,
+                 media_id: Optional[str] = None, forwarded: bool = False):
+        self.message_id = message_id
+        self.text = text
+        self.normalized = normalize_text(text) if text else ""
+        self.text_hash = hash_text(self.normalized) if text else 0
+        self.length = len(text)
+        self.caps_ratio = sum(map(str.isupper, text)) / self.length if text else 0.0
+        self.links = links
+        self.media_type = media_type
+        self.media_id = media_id
+        self.forwarded = forwarded
+        
+        # Identity of the content for cross-user duplicate counting (0 = not counted).
+        # Only content that carries links, media or a forward origin counts:
+        # members repeating plain text ("good morning everyone!") is conversation
+        if media_id and media_type not in self.COMMON_MEDIA:
+            self.content_hash = hash_text(f"{media_id}\0{self.normalized}")
+        elif text and (links or forwarded):
+            self.content_hash = self.text_hash
+        else:
+            self.content_hash = 0
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageFeatures":
+        media_type = next((kind for kind in cls.MEDIA_TYPES if getattr(message, kind, None)), None)
+        media_id = None
+        if media_type:
+            media = getattr(message, media_type)
+            if isinstance(media, (list, tuple)):  # photo sizes
+                media = media[-1]
+            media_id = getattr(media, 'file_unique_id', None)
+        return cls(
+            message.text or message.caption or "",
+            extract_urls(message),
+            media_type,
+            message.message_id,
+            media_id,
+            bool(getattr(message, 'forward_origin', None) or getattr(message, 'forward_date', None))
+        )
+
+class _NearDuplicateEntry:
+    __slots__ = ('timestamp', 'user_id', 'signature', 'empty_mask')
+
+    def __init__(self, timestamp: float, user_id: int, signature: int, empty_mask: int):
+        self.timestamp = timestamp
+        self.user_id = user_id
+        self.signature = signature
+        self.empty_mask = empty_mask  # the EMPTY bit of each empty bin
+
+class NearDuplicateIndex:
+    """Recent messages of one chat, indexed for near-duplicate lookup.
+
+    Each message gets a one-permutation MinHash signature over its word
+    unigrams and bigrams: shingle hashes are spread over BINS bins and the
+    minimum of each bin is kept. Pairs of bins form LSH bands, so messages
+    sharing most of their shingles almost always share a band bucket while
+    unrelated ones practically never do; a lookup only touches those
+    buckets. Entries expire after ``window`` seconds and both the index
+    and each bucket are capped, so memory and lookup cost stay bounded.
+
+    A signature is packed into one int, FIELD bits per bin, so comparing two
+    messages is a few int operations and an entry stays small.
+    """
+
+    BINS = 16
+    ROWS = 2          # bins per LSH band
+    FIELD = 32        # bits per bin in a packed signature
+    VALUE_BITS = 28   # crc32 // BINS is below 2**28
+    EMPTY = 1 << VALUE_BITS
+    TOKEN_PATTERN = re.compile(r'\w+')
+
+    # Per-field masks for counting unequal bins without unpacking
+    _ONES = ((1 << FIELD * BINS) - 1) // ((1 << FIELD) - 1)   # 1 in every field
+    _LOW = ((1 << VALUE_BITS + 1) - 1) * _ONES
+    _HIGH = (1 << VALUE_BITS + 1) * _ONES
+    _EMPTY_BITS = EMPTY * _ONES
+    _BAND_EMPTY_BITS = EMPTY * (1 + (1 << FIELD))
+
+    def __init__(self, window: float = 600, max_entries: int = 2000, max_bucket: int = 16,
+                 similarity: float = 0.6, min_tokens: int = 5):
+        self.window = window
+        self.max_entries = max_entries
+        self.max_bucket = max_bucket
+        self.similarity = similarity
+        self.min_tokens = min_tokens
+        self._entries: deque = deque()
+        self._buckets: Dict[int, List[_NearDuplicateEntry]] = {}
+
+    def signature(self, normalized: str) -> Optional[int]:
+        """Packed MinHash signature of a normalized text, or None if it is too short to judge"""
+        tokens = self.TOKEN_PATTERN.findall(normalized)
+        if len(tokens) < self.min_tokens:
+            return None
+        encoded = [token.encode('utf-8') for token in tokens]
+        unigrams = [zlib.crc32(token) for token in encoded]
+        # crc32 chains, so each bigram "a b" continues from the hash of "a"
+        hashes = set(unigrams)
+        hashes.update(zlib.crc32(b' ' + token, h) for h, token in zip(unigrams, encoded[1:]))
+        mins = array('I', [self.EMPTY]) * self.BINS
+        for h in hashes:
+            slot, value = h % self.BINS, h // self.BINS
+            if value < mins[slot]:
+                mins[slot] = value
+        return self._pack(mins)
+
+    @classmethod
+    def _pack(cls, values: List[int]) -> int:
+        """Bin values to a signature; bin i is the FIELD bits at FIELD * i"""
+        bins = array('I', (cls.EMPTY if value < 0 else value for value in values))
+        if sys.byteorder == 'big':
+            bins.byteswap()
+        return int.from_bytes(bins.tobytes(), 'little')
+
+    def _empty_mask(self, signature: int) -> int:
+        # EMPTY is the only bin value with that bit set
+        return signature & self._EMPTY_BITS
+
+    def _band_keys(self, signature: int) -> List[int]:
+        # A band is two adjacent fields, so the bands are the 64-bit words of
+        # the signature; the band number goes in the spare top bits of the
+        # first field. Bands with an empty bin would match every other short message
+        bands = array('Q', signature.to_bytes(self.BINS * self.FIELD // 8, 'little'))
+        if sys.byteorder == 'big':
+            bands.byteswap()
+        return [chunk | (band << self.VALUE_BITS + 1) for band, chunk in enumerate(bands)
+                if not chunk & self._BAND_EMPTY_BITS]
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window
+        entries = self._entries
+        while entries and (entries[0].timestamp < cutoff or len(entries) >= self.max_entries):
+            self._remove_oldest()
+
+    def _remove_oldest(self) -> None:
+        entry = self._entries.popleft()
+        for key in self._band_keys(entry.signature):
+            # Buckets are time-ordered, so an expiring entry is at the front if still present
+            bucket = self._buckets.get(key)
+            if bucket and bucket[0] is entry:
+                del bucket[0]
+                if not bucket:
+                    del self._buckets[key]
+
+    def _insert(self, entry: _NearDuplicateEntry, keys: List[int]) -> None:
+        self._entries.append(entry)
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._buckets[key] = [entry]
+            else:
+                if len(bucket) >= self.max_bucket:
+                    del bucket[0]
+                bucket.append(entry)
+
+    def add(self, user_id: int, signature: int, now: float) -> Set[int]:
+        """Index a message; returns the other users who recently sent a near-duplicate"""
+        self._expire(now)
+        keys = self._band_keys(signature)
+        mask = self._empty_mask(signature)
+        senders: Set[int] = set()
+        seen: Set[_NearDuplicateEntry] = set()
+        low, high, bins, threshold = self._LOW, self._HIGH, self.BINS, self.similarity
+        for key in keys:
+            for entry in self._buckets.get(key, ()):
+                if entry in seen or entry.user_id == user_id or entry.user_id in senders:
+                    continue
+                seen.add(entry)
+                # Share of equal bins, not counting bins empty in both. Adding the
+                # low mask carries into a field's spare top bit exactly when it differs
+                unequal = (((signature ^ entry.signature) + low) & high).bit_count()
+                both_empty = (mask & entry.empty_mask).bit_count()
+                filled = bins - both_empty
+                if filled and (bins - unequal - both_empty) / filled >= threshold:
+                    senders.add(entry.user_id)
+
+        self._insert(_NearDuplicateEntry(now, user_id, signature, mask), keys)
+        return senders
+
+    def evict_oldest(self, count: int) -> None:
+        """Drop up to count of the oldest entries (for a budget across chats)"""
+        for _ in range(min(count, len(self._entries))):
+            self._remove_oldest()
+
+    def approx_bytes(self) -> int:
+        """Memory held by the entries and buckets, roughly"""
+        if not self._entries:
+            return 0
+        sample = self._entries[0]
+        entry_size = sys.getsizeof(sample) + sys.getsizeof(sample.signature) + 8
+        bucket_size = sum(sys.getsizeof(bucket) for bucket in self._buckets.values())
+        key_size = len(self._buckets) * (sys.getsizeof(1 << 61) + 2 * 8)
+        return len(self._entries) * entry_size + bucket_size + key_size + sys.getsizeof(self._buckets)
+
+    def export_state(self, clock_offset: float) -> List[tuple]:
+        # tuple() copies the deque in one step, so this is safe off the event loop
+        return [(e.timestamp + clock_offset, e.user_id, e.signature) for e in tuple(self._entries)]
+
+    def restore_state(self, entries: List[list], clock_offset: float, now: float) -> None:
+        # Entries were already compared when first indexed; re-insert without searching
+        for timestamp, user_id, signature in entries[-self.max_entries:]:
+            timestamp -= clock_offset
+            if timestamp >= now - self.window:
+                if isinstance(signature, list):  # snapshots from before packed signatures
+                    signature = self._pack(signature)
+                self._insert(_NearDuplicateEntry(timestamp, user_id, signature, self._empty_mask(signature)),
+                             self._band_keys(signature))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SpamRecord:
+    """One message in a user's anti-spam history"""
+
+    __slots__ = ('timestamp', 'text_hash', 'message_id')
+
+    def __init__(self, timestamp: float, text_hash: int, message_id: int):
+        self.timestamp = timestamp  # time.monotonic()
+        self.text_hash = text_hash
+        self.message_id = message_id
+
+class _ContentSenders:
+    __slots__ = ('last_seen', 'senders')
+
+    def __init__(self, last_seen: float):
+        self.last_seen = last_seen
+        self.senders: Set[int] = set()
+
+class DuplicateContentCounter:
+    """Distinct senders of the same content per chat, over a sliding expiry.
+
+    Keys are (chat_id, content_hash) in order of last sighting, so content
+    nobody has reposted within ``window`` seconds is dropped from the front
+    in O(1) per entry. The number of keys and the senders kept per key are
+    both capped.
+    """
+
+    def __init__(self, window: float = 900, max_entries: int = 100000, max_senders: int = 64):
+        self.window = window
+        self.max_entries = max_entries
+        self.max_senders = max_senders
+        self._entries: "OrderedDict[Tuple[int, int], _ContentSenders]" = OrderedDict()
+
+    def add(self, chat_id: int, content_hash: int, user_id: int, now: float) -> int:
+        """Record a sender of the content; returns how many distinct users sent it"""
+        cutoff = now - self.window
+        entries = self._entries
+        while entries:
+            oldest = next(iter(entries.values()))
+            if oldest.last_seen >= cutoff and len(entries) < self.max_entries:
+                break
+            entries.popitem(last=False)
+        
+        key = (chat_id, content_hash)
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = _ContentSenders(now)
+        else:
+            entry.last_seen = now
+            entries.move_to_end(key)
+        if len(entry.senders) < self.max_senders:
+            entry.senders.add(user_id)
+        return len(entry.senders)
+
+    def export_state(self, clock_offset: float) -> Iterator[tuple]:
+        return (
+            (chat_id, content_hash, entry.last_seen + clock_offset, tuple(entry.senders))
+            for (chat_id, content_hash), entry in list(self._entries.items())
+        )
+
+    def restore_state(self, entries: List[list], clock_offset: float, now: float) -> None:
+        for chat_id, content_hash, last_seen, senders in entries:
+            last_seen -= clock_offset
+            if last_seen < now - self.window:
+                continue
+            entry = _ContentSenders(last_seen)
+            entry.senders.update(senders[:self.max_senders])
+            self._entries[(chat_id, content_hash)] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SpamPolicy:
+    """A group's anti-spam thresholds, compiled from config and group overrides"""
+
+    __slots__ = ('version', 'max_messages_per_minute', 'max_identical_messages', 'max_links_per_message',
+                 'near_duplicate_users', 'duplicate_content_users', 'caps_ratio', 'sensitivity',
+                 'spam_score', 'action_bands')
+
+    # Score offsets: a "high" sensitivity flags and escalates at lower scores
+    SENSITIVITY = {'low': 20, 'medium': 0, 'high': -10}
+
+    def __init__(self, version: int, settings: Dict[str, Any]):
+        self.version = version
+        self.max_messages_per_minute = int(settings['max_messages_per_minute'])
+        self.max_identical_messages = int(settings['max_identical_messages'])
+        self.max_links_per_message = int(settings['max_links_per_message'])
+        self.near_duplicate_users = int(settings['near_duplicate_users'])
+        self.duplicate_content_users = int(settings['duplicate_content_users'])
+        self.caps_ratio = float(settings['caps_ratio'])
+        self.sensitivity = settings['spam_detection_sensitivity']
+        offset = self.SENSITIVITY.get(self.sensitivity, 0)
+        self.spam_score = 50 + offset
+        mute = 'mute' if settings.get('auto_mute_spammers', True) else 'warn'
+        self.action_bands = ((80 + offset, 'ban'), (60 + offset, mute), (40 + offset, 'warn'))
+
+    def action(self, score: int) -> str:
+        for threshold, action in self.action_bands:
+            if score >= threshold:
+                return action
+        return 'delete'
+
 class AntiSpamSystem:
     """Advanced anti-spam detection system"""
     
     def __init__(self):
-        self.user_message_history: Dict[int, List[Dict]] = {}
+        # Per (chat, user), least recently active first; each history is
+        # newest last and bounded so one flooding user costs the same as a quiet one
+        self.user_message_history: "OrderedDict[Tuple[int, int], deque]" = OrderedDict()
+        self.history_size = 64
+        self.identical_window = 10  # recent messages compared for repeats
+        self.history_ttl = 3600
+        self.max_tracked_users = 50000
+        # Near-duplicate indexes for the most recently active chats
+        self.near_duplicates: "OrderedDict[int, NearDuplicateIndex]" = OrderedDict()
+        self.max_indexed_chats = 1000
+        # Budget across all chats; the least recently active chats give way first
+        self.max_indexed_messages = 50000
+        self._indexed_messages = 0
+        # Exact content (text, captions, media) reposted by different users
+        self.duplicate_content = DuplicateContentCounter()
         self.spam_thresholds = {
             'max_messages_per_minute': 10,
             'max_identical_messages': 3,
             'max_links_per_message': 2,
+            'near_duplicate_users': 4,
+            'duplicate_content_users': 3,
+            'caps_ratio': 0.7,
+            'spam_detection_sensitivity': 'medium',
+            'auto_mute_spammers': True,
             'cooldown_period': 300  # 5 minutes
         }
-    
-    def check_spam(self, user_id: int, message: Message) -> Dict:
-        """Check if message is spam"""
-        now = datetime.now()
         
-        if user_id not in self.user_message_history:
-            self.user_message_history[user_id] = []
+        # Compiled policies per group; bumping the version makes them all stale
+        self.policy_version = 0
+        self.default_policy = SpamPolicy(self.policy_version, self.spam_thresholds)
+        self._policies: "OrderedDict[str, SpamPolicy]" = OrderedDict()
+        self.max_cached_policies = 1000
+    
+    def configure(self, settings: Dict[str, Any]) -> None:
+        """Apply the global config["anti_spam"] section"""
+        for key, value in settings.items():
+            if key in self.spam_thresholds:
+                self.spam_thresholds[key] = value
+        for key, cap in self.countable_limits().items():
+            if int(self.spam_thresholds[key]) > cap:
+                logger.warning(f"⚠️ anti_spam.{key} = {self.spam_thresholds[key]} can never be exceeded; using {cap}")
+                self.spam_thresholds[key] = cap
+        self.policy_version += 1
+        self.default_policy = SpamPolicy(self.policy_version, self.spam_thresholds)
+        self._policies.clear()
+    
+    def group_policy(self, chat_key: str, group: Dict) -> SpamPolicy:
+        """Compiled policy for a group (the default one if it has no overrides)"""
+        overrides = group.get("anti_spam")
+        if not overrides:
+            return self.default_policy
+        
+        cached = self._policies.get(chat_key)
+        if cached is not None and cached.version == self.policy_version:
+            self._policies.move_to_end(chat_key)
+            return cached
+        
+        settings = {**self.spam_thresholds, **overrides}
+        for key, cap in self.countable_limits().items():
+            settings[key] = min(int(settings[key]), cap)
+        policy = SpamPolicy(self.policy_version, settings)
+        self._policies[chat_key] = policy
+        while len(self._policies) > self.max_cached_policies:
+            self._policies.popitem(last=False)
+        return policy
+    
+    def countable_limits(self) -> Dict[str, int]:
+        """Highest thresholds the bounded histories can still exceed.
         
-        user_history = self.user_message_history[user_id]
+        Only the last history_size messages are kept and identical_window
+        compared, so a higher limit would silently never fire.
+        """
+        return {
+            'max_messages_per_minute': self.history_size - 1,
+            'max_identical_messages': self.identical_window - 1
+        }
+    
+    def invalidate_policy(self, chat_key: str) -> None:
+        """Drop a group's compiled policy after its overrides change"""
+        self._policies.pop(chat_key, None)
+    
+    def check_spam(self, chat_id: int, user_id: int, features: MessageFeatures,
+                   policy: Optional[SpamPolicy] = None) -> Dict:
+        """Check if message is spam"""
+        policy = policy or self.default_policy
+        now = time.monotonic()
+        cutoff = now - self.history_ttl
+        self._evict_idle(cutoff)
+        
+        key = (chat_id, user_id)
+        user_history = self.user_message_history.get(key)
+        if user_history is None:
+            user_history = self.user_message_history[key] = deque(maxlen=self.history_size)
+            while len(self.user_message_history) > self.max_tracked_users:
+                self.user_message_history.popitem(last=False)
+        else:
+            self.user_message_history.move_to_end(key)
         
-        # Clean old messages (older than 1 hour)
-        user_history[:] = [msg for msg in user_history if 
-                          (now - datetime.fromisoformat(msg['timestamp'])).seconds < 3600]
+        # Clean old messages (older than 1 hour); the oldest are on the left
+        while user_history and user_history[0].timestamp < cutoff:
+            user_history.popleft()
         
         # Add current message
-        current_msg = {
-            'text': message.text or '',
-            'timestamp': now.isoformat(),
-            'message_id': message.message_id
-        }
-        user_history.append(current_msg)
+        user_history.append(SpamRecord(now, features.text_hash, features.message_id))
         
         # Check various spam indicators
         spam_score = 0
         violations = []
         
-        # 1. Message frequency check
-        recent_messages = [msg for msg in user_history if 
-                          (now - datetime.fromisoformat(msg['timestamp'])).seconds < 60]
+        # 1. Message frequency check (walks back only through the last minute)
+        recent_count = 0
+        for msg in reversed(user_history):
+            if now - msg.timestamp >= 60:
+                break
+            recent_count += 1
         
-        if len(recent_messages) > self.spam_thresholds['max_messages_per_minute']:
+        if recent_count > policy.max_messages_per_minute:
             spam_score += 50
-            violations.append(f"Too many messages: {len(recent_messages)}/min")
+            violations.append(f"Too many messages: {recent_count}/min")
         
         # 2. Identical message check
-        if message.text:
-            identical_count = sum(1 for msg in user_history[-10:] 
-                                if msg['text'] == message.text)
-            if identical_count > self.spam_thresholds['max_identical_messages']:
+        if features.text:
+            identical_count = sum(1 for msg in islice(reversed(user_history), self.identical_window)
+                                if msg.text_hash == features.text_hash)
+            if identical_count > policy.max_identical_messages:
                 spam_score += 40
                 violations.append(f"Repeated message {identical_count} times")
         
         # 3. Link spam check
-        if message.text and message.entities:
-            link_count = sum(1 for entity in message.entities 
-                           if entity.type in [MessageEntityType.URL, MessageEntityType.TEXT_LINK])
-            if link_count > self.spam_thresholds['max_links_per_message']:
+        if features.links:
+            link_count = len(features.links)
+            if link_count > policy.max_links_per_message:
                 spam_score += 30
                 violations.append(f"Too many links: {link_count}")
         
         # 4. Caps lock check
-        if message.text and len(message.text) > 10:
-            caps_ratio = sum(1 for c in message.text if c.isupper()) / len(message.text)
-            if caps_ratio > 0.7:
-                spam_score += 20
-                violations.append("Excessive caps lock")
+        if features.length > 10 and features.caps_ratio > policy.caps_ratio:
+            spam_score += 20
+            violations.append("Excessive caps lock")
+        
+        # 5. The same content from several users (forwarded spam waves), or
+        # 6. near-duplicates of other users' recent messages (coordinated campaigns)
+        copies = 0
+        if features.content_hash:
+            copies = self.duplicate_content.add(chat_id, features.content_hash, user_id, now)
+        senders = self._near_duplicate_senders(chat_id, user_id, features)
+        if copies >= policy.duplicate_content_users:
+            spam_score += 50
+            violations.append(f"Same content posted by {copies} users")
+        elif len(senders) + 1 >= policy.near_duplicate_users:
+            # Members echoing each other ("happy birthday!") is normal chat, so
+            # plain text only adds to the score; with links, media or a forward
+            # origin it is a campaign on its own
+            carries_payload = features.links or features.media_type or features.forwarded
+            spam_score += 50 if carries_payload else 30
+            violations.append(f"Near-duplicate of messages from {len(senders)} other users")
         
         return {
-            'is_spam': spam_score >= 50,
+            'is_spam': spam_score >= policy.spam_score,
             'spam_score': spam_score,
             'violations': violations,
-            'suggested_action': self._get_spam_action(spam_score)
+            'suggested_action': policy.action(spam_score)
         }
     
-    def _get_spam_action(self, score: int) -> str:
-        """Get suggested action based on spam score"""
-        if score >= 80:
-            return 'ban'
-        elif score >= 60:
-            return 'mute'
-        elif score >= 40:
-            return 'warn'
+    def export_state(self, clock_offset: float) -> Dict[str, Iterator]:
+        """Message windows and counters as rows with wall-clock times.
+
+        Rows are generated lazily from copies of the containers (list() and
+        tuple() take them in one step), so they can be written from a thread
+        while the event loop keeps updating the state.
+        """
+        return {
+            "history": (
+                (chat_id, user_id, [(r.timestamp + clock_offset, r.text_hash, r.message_id) for r in tuple(records)])
+                for (chat_id, user_id), records in list(self.user_message_history.items()) if records
+            ),
+            "near_duplicates": (
+                (chat_id, index.export_state(clock_offset)) for chat_id, index in list(self.near_duplicates.items())
+            ),
+            "duplicate_content": self.duplicate_content.export_state(clock_offset)
+        }
+    
+    def restore_state(self, state: Dict[str, Any], clock_offset: float) -> None:
+        """Load exported state, skipping anything that has already expired"""
+        now = time.monotonic()
+        cutoff = now - self.history_ttl
+        for chat_id, user_id, records in state.get("history", []):
+            history = deque(
+                (SpamRecord(timestamp - clock_offset, text_hash, message_id)
+                 for timestamp, text_hash, message_id in records
+                 if timestamp - clock_offset >= cutoff),
+                maxlen=self.history_size
+            )
+            if history:
+                self.user_message_history[(chat_id, user_id)] = history
+        while len(self.user_message_history) > self.max_tracked_users:
+            self.user_message_history.popitem(last=False)
+        
+        for chat_id, entries in state.get("near_duplicates", [])[-self.max_indexed_chats:]:
+            index = NearDuplicateIndex()
+            index.restore_state(entries, clock_offset, now)
+            if len(index):
+                self.near_duplicates[chat_id] = index
+                self._indexed_messages += len(index)
+        self._enforce_index_budget(None)
+        
+        self.duplicate_content.restore_state(state.get("duplicate_content", []), clock_offset, now)
+    
+    def _evict_idle(self, cutoff: float) -> None:
+        """Drop users whose whole history has expired.
+        
+        The dict is in activity order, so idle users sit at the front and
+        this stops at the first one still active.
+        """
+        history = self.user_message_history
+        while history:
+            key, records = next(iter(history.items()))
+            if records and records[-1].timestamp >= cutoff:
+                break
+            del history[key]
+    
+    def footprint(self) -> Dict[str, int]:
+        """Current size of the in-memory anti-spam state"""
+        records = sum(len(h) for h in self.user_message_history.values())
+        record_size = sys.getsizeof(SpamRecord(0.0, 0, 0))
+        history_size = sys.getsizeof(deque(maxlen=self.history_size)) + sys.getsizeof((0, 0))
+        index_bytes = sum(index.approx_bytes() for index in self.near_duplicates.values())
+        return {
+            'tracked_users': len(self.user_message_history),
+            'history_records': records,
+            'indexed_chats': len(self.near_duplicates),
+            'indexed_messages': self._indexed_messages,
+            'content_keys': len(self.duplicate_content),
+            'approx_bytes': len(self.user_message_history) * history_size + records * record_size + index_bytes
+        }
+    
+    def _near_duplicate_senders(self, chat_id: int, user_id: int, features: MessageFeatures) -> Set[int]:
+        index = self.near_duplicates.get(chat_id)
+        if index is None:
+            index = self.near_duplicates[chat_id] = NearDuplicateIndex()
+            while len(self.near_duplicates) > self.max_indexed_chats:
+                _, idle = self.near_duplicates.popitem(last=False)
+                self._indexed_messages -= len(idle)
+        else:
+            self.near_duplicates.move_to_end(chat_id)
+        
+        signature = index.signature(features.normalized)
+        if signature is None:
+            return set()
+        before = len(index)
+        senders = index.add(user_id, signature, time.monotonic())
+        self._indexed_messages += len(index) - before
+        self._enforce_index_budget(index)
+        return senders
+    
+    def _enforce_index_budget(self, current: Optional[NearDuplicateIndex]) -> None:
+        """Drop the least recently active chats' indexes until under the global budget"""
+        while self._indexed_messages > self.max_indexed_messages and self.near_duplicates:
+            chat_id, index = next(iter(self.near_duplicates.items()))
+            if index is current:
+                # Only the active chat is left: trim its oldest entries instead
+                excess = self._indexed_messages - self.max_indexed_messages
+                index.evict_oldest(excess)
+                self._indexed_messages -= excess
+                break
+            del self.near_duplicates[chat_id]
+            self._indexed_messages -= len(index)
+    
+
+class RateLimiter:
+    """Per-key rate limiting with O(1) state per key.
+
+    ``sliding_window`` approximates a sliding window from the counts of the
+    current and previous fixed windows; ``token_bucket`` refills ``limit``
+    tokens per ``window`` and allows bursts up to ``limit``. Either way a
+    key costs three floats in flat arrays however many events it has seen,
+    and the least recently used keys are recycled past ``max_keys``.
+    """
+
+    SLIDING_WINDOW, TOKEN_BUCKET = 'sliding_window', 'token_bucket'
+
+    def __init__(self, algorithm: str = SLIDING_WINDOW, max_keys: int = 100000):
+        if algorithm not in (self.SLIDING_WINDOW, self.TOKEN_BUCKET):
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.max_keys = max_keys
+        self._slots: "OrderedDict[Any, int]" = OrderedDict()
+        # sliding window: current window start, previous count, current count
+        # token bucket:   last refill time, tokens, unused
+        self._stamp = array('d')
+        self._a = array('d')
+        self._b = array('d')
+
+    def _slot(self, key: Any) -> Tuple[int, bool]:
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slots.move_to_end(key)
+            return slot, False
+        if len(self._slots) < self.max_keys:
+            slot = len(self._stamp)
+            self._stamp.append(0.0)
+            self._a.append(0.0)
+            self._b.append(0.0)
+        else:
+            _, slot = self._slots.popitem(last=False)
+        self._slots[key] = slot
+        return slot, True
+
+    def hit(self, key: Any, limit: float, window: float, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Record one event; returns (allowed, level) where level > limit means over the limit"""
+        if now is None:
+            now = time.monotonic()
+        slot, new = self._slot(key)
+        
+        if self.algorithm == self.TOKEN_BUCKET:
+            tokens = float(limit) if new else min(limit, self._a[slot] + (now - self._stamp[slot]) * limit / window)
+            self._stamp[slot] = now
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._a[slot] = tokens
+            return allowed, limit - tokens + (0 if allowed else 1)
+        
+        # Windows are anchored at each key's first event rather than aligned globally
+        start = self._stamp[slot]
+        if new or now - start >= 2 * window:
+            self._a[slot] = self._b[slot] = 0.0
+            start = now
+        elif now - start >= window:
+            self._a[slot], self._b[slot] = self._b[slot], 0.0
+            start += window
+        self._stamp[slot] = start
+        self._b[slot] += 1
+        elapsed = (now - start) / window
+        level = self._a[slot] * (1 - elapsed) + self._b[slot]
+        return level <= limit, level
+
+    def export_state(self, clock_offset: float, max_age: float) -> Iterator[tuple]:
+        """Keys active within max_age seconds, least recent first, with wall-clock times"""
+        cutoff = time.monotonic() - max_age
+        return (
+            (list(key) if isinstance(key, tuple) else key, self._stamp[slot] + clock_offset, self._a[slot], self._b[slot])
+            for key, slot in list(self._slots.items()) if self._stamp[slot] >= cutoff
+        )
+
+    def restore_state(self, entries: List[list], clock_offset: float, max_age: float) -> None:
+        cutoff = time.monotonic() - max_age
+        for key, stamp, a, b in entries:
+            stamp -= clock_offset
+            if stamp < cutoff:
+                continue
+            slot, _ = self._slot(tuple(key) if isinstance(key, list) else key)
+            self._stamp[slot], self._a[slot], self._b[slot] = stamp, a, b
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+class StateBackend(ABC):
+    """Interface for runtime state that several bot workers may share.
+
+    Counters are integers, windows are sliding-window rate counters (see
+    RateLimiter) and key-value entries hold JSON-serialisable values.
+    Backends with ``blocking`` set may wait on disk or other processes;
+    hot-path calls from the event loop go through GroupMegBot._state_call.
+    """
+
+    blocking = False
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def hit_window(self, key: str, limit: float, window: float) -> Tuple[bool, float]:
+        """Record one event; returns (allowed, level) like RateLimiter.hit"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Remove a key; True only for the caller that actually removed it"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def scan(self, prefix: str) -> List[Tuple[str, Any]]:
+        raise NotImplementedError
+
+    def prune(self, max_age: float = 3600) -> None:
+        """Drop windows idle for longer than max_age seconds"""
+        pass
+
+    def export_state(self, clock_offset: float) -> Optional[Dict[str, Any]]:
+        """State to include in restart snapshots (None if the backend persists itself)"""
+        return None
+
+    def restore_state(self, state: Dict[str, Any], clock_offset: float) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class InProcessStateBackend(StateBackend):
+    """State in this process only; windows use the array-backed RateLimiter"""
+
+    WINDOW_MAX_AGE = 3600  # windows idle longer than this are not snapshotted
+
+    def __init__(self, max_windows: int = 100000):
+        self._counters: Dict[str, int] = {}
+        self._windows = RateLimiter(RateLimiter.SLIDING_WINDOW, max_keys=max_windows)
+        self._values: Dict[str, Any] = {}
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        value = self._counters.get(key, 0) + amount
+        self._counters[key] = value
+        return value
+
+    def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def hit_window(self, key: str, limit: float, window: float) -> Tuple[bool, float]:
+        return self._windows.hit(key, limit, window)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._values.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self._values[key] = value
+
+    def delete(self, key: str) -> bool:
+        return self._values.pop(key, None) is not None
+
+    def scan(self, prefix: str) -> List[Tuple[str, Any]]:
+        return [(key, value) for key, value in self._values.items() if key.startswith(prefix)]
+
+    def export_state(self, clock_offset: float) -> Optional[Dict[str, Any]]:
+        # Counters are per-run statistics and start from zero after a restart
+        return {
+            "windows": self._windows.export_state(clock_offset, self.WINDOW_MAX_AGE),
+            "values": list(self._values.items())
+        }
+
+    def restore_state(self, state: Dict[str, Any], clock_offset: float) -> None:
+        self._windows.restore_state(state.get("windows", []), clock_offset, self.WINDOW_MAX_AGE)
+        self._values.update((key, value) for key, value in state.get("values", []))
+
+class SQLiteStateBackend(StateBackend):
+    """State in a WAL-mode SQLite file shared by every worker on the host.
+
+    Read-modify-write updates run inside BEGIN IMMEDIATE transactions, so
+    concurrent workers never lose each other's increments. Window times
+    are wall-clock because monotonic clocks differ between processes.
+    A write can wait up to ``busy_timeout`` for another worker's
+    transaction, so the bot runs per-message calls in a thread.
+    """
+
+    blocking = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS windows (
+            key TEXT PRIMARY KEY,
+            start REAL NOT NULL,
+            previous REAL NOT NULL,
+            current REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS kv (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: Path, busy_timeout: float = 5.0):
+        self.db_path = db_path
+        # Autocommit mode; transactions are opened explicitly where needed
+        self.conn = sqlite3.connect(str(db_path), timeout=busy_timeout, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        logger.info(f"✅ Opened shared state at {db_path}")
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            row = self.conn.execute(
+                "INSERT INTO counters (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + excluded.value RETURNING value",
+                (key, amount)
+            ).fetchone()
+        return row[0]
+
+    def get_counter(self, key: str) -> int:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def hit_window(self, key: str, limit: float, window: float) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT start, previous, current FROM windows WHERE key = ?", (key,)
+                ).fetchone()
+                # Same arithmetic as RateLimiter's sliding window
+                if row is None or now - row[0] >= 2 * window:
+                    start, previous, current = now, 0.0, 0.0
+                elif now - row[0] >= window:
+                    start, previous, current = row[0] + window, row[2], 0.0
+                else:
+                    start, previous, current = row
+                current += 1
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO windows (key, start, previous, current) VALUES (?, ?, ?, ?)",
+                    (key, start, previous, current)
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        level = previous * (1 - (now - start) / window) + current
+        return level <= limit, level
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self.conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+
+    def scan(self, prefix: str) -> List[Tuple[str, Any]]:
+        # Range scan on the primary key instead of LIKE, which would treat _ and % as wildcards
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, value FROM kv WHERE key >= ? AND key < ?", (prefix, prefix + '\uffff')
+            ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def prune(self, max_age: float = 3600) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM windows WHERE start < ?", (time.time() - max_age,))
+
+    def close(self) -> None:
+        self.conn.close()
+
+def create_state_backend(data_dir: Path, backend: str) -> StateBackend:
+    """Create the runtime state backend selected by name ('memory' or 'sqlite')"""
+    if backend == "sqlite":
+        return SQLiteStateBackend(data_dir / "state.db")
+    if backend != "memory":
+        logger.warning(f"⚠️ Unknown state backend '{backend}', using memory")
+    return InProcessStateBackend()
+
+class BotStats:
+    """Bot statistics; event counters live in the state backend so workers add up.
+
+    Increments are batched in memory and written by flush(), which also
+    refreshes the totals read back, so neither counting an event nor
+    reading a counter waits on a shared backend. Other workers' counts
+    show up after the next flush.
+    """
+
+    COUNTERS = ("commands_used", "messages_filtered", "spam_blocked")
+
+    def __init__(self, state: StateBackend, **local: Any):
+        self.state = state
+        self.local = local
+        self._pending: Dict[str, int] = {}
+        self._flushing: Dict[str, int] = {}
+        self._totals: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._pending[name] = self._pending.get(name, 0) + amount
+
+    def flush(self) -> None:
+        """Add the batched increments to the backend's counters and read back the totals"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushing = pending
+        totals = None
+        try:
+            for name, amount in pending.items():
+                self.state.incr(f"stats:{name}", amount)
+            totals = {name: self.state.get_counter(f"stats:{name}") for name in self.COUNTERS}
+        finally:
+            with self._lock:
+                self._flushing = {}
+                if totals is not None:
+                    self._totals = totals
+
+    def __getitem__(self, name: str) -> Any:
+        if name in self.COUNTERS:
+            with self._lock:
+                return self._totals.get(name, 0) + self._flushing.get(name, 0) + self._pending.get(name, 0)
+        return self.local[name]
+
+class WriteBehindStore:
+    """Coalescing background writer for JSON data files"""
+
+    def __init__(self, data_dir: Path, flush_interval: float = 0.3):
+        self.data_dir = data_dir
+        self.flush_interval = flush_interval
+        self._dirty: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, filename: str, data: Any) -> None:
+        """Schedule data to be written to filename on the next flush"""
+        with self._lock:
+            self._dirty[filename] = data
+        self._wakeup.set()
+
+    def pending(self, filename: str) -> Any:
+        """Return data queued for filename but not yet written, if any"""
+        with self._lock:
+            return self._dirty.get(filename)
+
+    def flush(self, filename: Optional[str] = None) -> None:
+        """Write pending data now (all files, or just one)"""
+        with self._lock:
+            if filename is None:
+                pending = self._dirty
+                self._dirty = {}
+            elif filename in self._dirty:
+                pending = {filename: self._dirty.pop(filename)}
+            else:
+                pending = {}
+
+        for name, data in pending.items():
+            if not self._write(name, data):
+                # Keep the newest copy if the file was re-dirtied meanwhile
+                with self._lock:
+                    self._dirty.setdefault(name, data)
+
+    def close(self) -> None:
+        """Stop the writer thread and force a final flush"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait()
+            if self._closed:
+                break
+            # Let bursts of changes pile up into a single write
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _write(self, filename: str, data: Any) -> bool:
+        filepath = self.data_dir / filename
+        # The event loop may mutate data while we serialize it; retry on that
+        for _ in range(3):
+            try:
+                payload = json.dumps(data, indent=2, ensure_ascii=False)
+                break
+            except RuntimeError:
+                time.sleep(0.01)
+        else:
+            logger.warning(f"⚠️ {filename} kept changing during save, retrying later")
+            return False
+
+        try:
+            atomic_write_text(filepath, payload)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving {filename}: {e}")
+            return False
+
+def _new_file_mode() -> int:
+    """Mode open() would give a new file under the current umask.
+
+    Linux reports the umask in /proc; elsewhere it can only be read by
+    setting it, which briefly affects other threads, so that is the fallback.
+    """
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def atomic_write_text(filepath: Path, payload: Union[str, Iterable[str]]) -> None:
+    """Write a file atomically via a temp file and rename.
+
+    payload is the text or an iterable of pieces, written as they come.
+    mkstemp creates the temp file 0600; it is given the existing file's
+    mode (or the umask default for new files) before the rename.
+    """
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        mode = filepath.stat().st_mode & 0o7777
+    except FileNotFoundError:
+        mode = _new_file_mode()
+    fd, tmp_path = tempfile.mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".tmp")
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines((payload,) if isinstance(payload, str) else payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def json_chunks(value: Any, batch: int = 64) -> Iterator[str]:
+    """Compact JSON for value, in pieces.
+
+    Lists and other iterables (generators included) are encoded a batch of
+    items at a time, so a large state snapshot is never held fully built
+    and each json.dumps call is short: a thread writing it lets the event
+    loop run between batches.
+    """
+    if isinstance(value, dict):
+        yield '{'
+        for i, (key, item) in enumerate(value.items()):
+            yield (',' if i else '') + json.dumps(str(key)) + ':'
+            yield from json_chunks(item, batch)
+        yield '}'
+    elif isinstance(value, (str, bytes)) or not isinstance(value, Iterable):
+        yield json.dumps(value, separators=(',', ':'))
+    else:
+        yield '['
+        items = iter(value)
+        first = True
+        while True:
+            rows = list(islice(items, batch))
+            if not rows:
+                break
+            yield ('' if first else ',') + json.dumps(rows, separators=(',', ':'))[1:-1]
+            first = False
+        yield ']'
+
+class WarningsJournal:
+    """Append-only JSONL journal of warning events over a compacted snapshot.
+
+    Every warn/clear is one appended line. Once enough events pile up the
+    journal is rotated and the snapshot rewritten on a background thread.
+    Warnings carry their journal sequence number as "id", which makes
+    replaying the tail over a newer snapshot idempotent.
+    """
+
+    def __init__(self, data_dir: Path, snapshot_name: str = "warnings.json", compact_every: int = 1000):
+        self.snapshot_path = data_dir / snapshot_name
+        self.journal_path = data_dir / "warnings.journal"
+        self.rotated_path = data_dir / "warnings.journal.old"
+        self.compact_every = compact_every
+        self.data: Dict[str, Dict[str, List[Dict]]] = {}
+        self.next_seq = 1
+        self._events_since_compact = 0
+        self._journal = None
+        self._compactor: Optional[threading.Thread] = None
+
+    @staticmethod
+    def read_state(data_dir: Path, snapshot_name: str = "warnings.json") -> Dict:
+        """Load snapshot plus journal tail without opening the journal for writing"""
+        journal = WarningsJournal(data_dir, snapshot_name)
+        journal._restore()
+        return journal.data
+
+    def open(self) -> Dict:
+        """Restore state and open the journal for appending"""
+        self._restore()
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        return self.data
+
+    def _restore(self) -> None:
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f) or {}
+            logger.info(f"✅ Loaded {self.snapshot_path.name} successfully")
+        except FileNotFoundError:
+            self.data = {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Could not load {self.snapshot_path.name}, starting empty: {e}")
+            self.data = {}
+
+        max_seq = max(
+            (w.get("id", 0) for chat in self.data.values() for user in chat.values() for w in user),
+            default=0
+        )
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn final line from a crash mid-append
+                        continue
+                    self._apply(event)
+                    max_seq = max(max_seq, event.get("seq", 0))
+                    replayed += 1
+
+        self.next_seq = max_seq + 1
+        self._events_since_compact = replayed
+        if replayed:
+            logger.info(f"🔁 Replayed {replayed} warning journal events")
+
+    def _apply(self, event: Dict) -> None:
+        chat_key, user_key = event["chat"], event["user"]
+        if event["op"] == "warn":
+            user_warnings = self.data.setdefault(chat_key, {}).setdefault(user_key, [])
+            if not any(w.get("id") == event["seq"] for w in user_warnings):
+                user_warnings.append(event["warning"])
+        elif event["op"] == "clear":
+            self.data.get(chat_key, {}).pop(user_key, None)
+
+    def _append(self, event: Dict) -> None:
+        event["seq"] = self.next_seq
+        self.next_seq += 1
+        self._apply(event)
+        try:
+            self._journal.write(json.dumps(event, ensure_ascii=False) + '\n')
+            self._journal.flush()
+        except Exception as e:
+            logger.error(f"Failed to append warning journal: {e}")
+
+        self._events_since_compact += 1
+        if self._events_since_compact >= self.compact_every:
+            self.compact()
+
+    def add(self, chat_key: str, user_key: str, warning: Dict) -> int:
+        warning = dict(warning, id=self.next_seq)
+        self._append({"op": "warn", "chat": chat_key, "user": user_key, "warning": warning})
+        return len(self.data[chat_key][user_key])
+
+    def clear(self, chat_key: str, user_key: str) -> bool:
+        if user_key not in self.data.get(chat_key, {}):
+            return False
+        self._append({"op": "clear", "chat": chat_key, "user": user_key})
+        return True
+
+    def compact(self, wait: bool = False) -> None:
+        """Rotate the journal and rewrite the snapshot"""
+        if self._compactor is not None and self._compactor.is_alive():
+            if not wait:
+                return
+            self._compactor.join()
+        if self.rotated_path.exists():
+            # A previous compaction did not finish; fold it into this one
+            self._write_snapshot()
+            if self.rotated_path.exists():
+                return
+        self._journal.close()
+        os.replace(self.journal_path, self.rotated_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._events_since_compact = 0
+
+        self._compactor = threading.Thread(target=self._write_snapshot, name="warnings-compact", daemon=True)
+        self._compactor.start()
+        if wait:
+            self._compactor.join()
+
+    def _write_snapshot(self) -> None:
+        for _ in range(3):
+            try:
+                payload = json.dumps(self.data, indent=2, ensure_ascii=False)
+                break
+            except RuntimeError:
+                time.sleep(0.01)
         else:
-            return 'delete'
+            logger.warning("⚠️ Warnings kept changing during compaction, retrying later")
+            return
+        try:
+            atomic_write_text(self.snapshot_path, payload)
+            self.rotated_path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Error compacting warnings: {e}")
+
+    def close(self) -> None:
+        if self._journal is None:
+            return
+        if self._events_since_compact or self.rotated_path.exists():
+            self.compact(wait=True)
+        self._journal.close()
+        self._journal = None
+
+class StorageBackend(ABC):
+    """Interface for persisting group settings, user roles and warnings"""
+
+    @abstractmethod
+    def get_group(self, chat_key: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_group(self, chat_key: str, data: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_groups(self) -> int:
+        raise NotImplementedError
+
+    def release_group(self, chat_key: str) -> None:
+        """Called on the event loop when a chat is evicted from memory; must not block"""
+
+    @abstractmethod
+    def get_roles(self, chat_id: int, user_id: int) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_roles(self, chat_id: int, user_id: int, roles: List[str]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_roles(self, chat_id: int) -> Iterator[Tuple[int, List[str]]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_users(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_warnings(self, chat_id: int, user_id: int) -> List[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_warning(self, chat_id: int, user_id: int, warning: Dict) -> int:
+        """Store a warning and return the user's new warning count"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_warnings(self, chat_id: int, user_id: int) -> bool:
+        """Remove all warnings for a user, returning False if there were none"""
+        raise NotImplementedError
+
+    def reload(self) -> None:
+        """Re-read data from disk after external edits"""
+
+    def flush(self) -> None:
+        """Persist any buffered changes"""
+
+    def close(self) -> None:
+        self.flush()
+
+class JsonStorageBackend(StorageBackend):
+    """Storage in per-chat groups/<chat_id>.json shards and users.json via
+    the write-behind store, with warnings kept in an append-only journal"""
+
+    GROUPS_DIR = "groups"
+
+    def __init__(self, data_dir: Path):
+        self.data_dir = data_dir
+        self.store = WriteBehindStore(data_dir)
+        self.warnings_journal: Optional[WarningsJournal] = None
+        self.reload()
+
+    def load_json_file(self, filename: str, default: Any) -> Any:
+        """Load JSON file with default fallback"""
+        filepath = self.data_dir / filename
+        try:
+            if filepath.exists():
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    logger.info(f"✅ Loaded {filename} successfully")
+                    return data
+            else:
+                logger.info(f"📁 {filename} not found, creating with defaults")
+                self.save_json_file(filename, default)
+                return default
+        except json.JSONDecodeError as e:
+            logger.warning(f"⚠️ Invalid JSON in {filename}, using defaults: {e}")
+            return default
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load {filename}, using defaults: {e}")
+            return default
+
+    def save_json_file(self, filename: str, data: Any) -> None:
+        """Queue data to be saved to JSON file by the write-behind store"""
+        self.store.mark_dirty(filename, data)
+
+    def _group_file(self, chat_key: str) -> str:
+        return f"{self.GROUPS_DIR}/{chat_key}.json"
+
+    def get_group(self, chat_key: str) -> Optional[Dict]:
+        if chat_key not in self.group_keys:
+            return None
+        filename = self._group_file(chat_key)
+        pending = self.store.pending(filename)
+        if pending is not None:
+            return pending
+        try:
+            with open(self.data_dir / filename, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Could not load {filename}: {e}")
+            return None
+
+    def save_group(self, chat_key: str, data: Dict) -> None:
+        self.group_keys.add(chat_key)
+        self.save_json_file(self._group_file(chat_key), data)
+
+    def count_groups(self) -> int:
+        return len(self.group_keys)
+
+    def release_group(self, chat_key: str) -> None:
+        # Nothing to write on the event loop: a dirty shard is already queued on
+        # the write-behind thread, and get_group serves it from pending() until then
+        pass
+
+    def _load_group_keys(self) -> Set[str]:
+        """Index the group shards, splitting a legacy groups.json on first run"""
+        groups_dir = self.data_dir / self.GROUPS_DIR
+        legacy_path = self.data_dir / "groups.json"
+        if not groups_dir.exists() and legacy_path.exists():
+            legacy = self.load_json_file("groups.json", {})
+            for chat_key, data in legacy.items():
+                atomic_write_text(
+                    groups_dir / f"{chat_key}.json",
+                    json.dumps(data, indent=2, ensure_ascii=False)
+                )
+            legacy_path.rename(legacy_path.with_suffix(".json.bak"))
+            logger.info(f"📦 Split groups.json into {len(legacy)} per-chat files")
+
+        groups_dir.mkdir(exist_ok=True)
+        return {entry.name[:-5] for entry in os.scandir(groups_dir) if entry.name.endswith(".json")}
+
+    def get_roles(self, chat_id: int, user_id: int) -> List[str]:
+        return self.users_data.get(f"{chat_id}_{user_id}", {}).get("roles", [])
+
+    def set_roles(self, chat_id: int, user_id: int, roles: List[str]) -> None:
+        self.users_data.setdefault(f"{chat_id}_{user_id}", {})["roles"] = list(roles)
+        self.save_json_file("users.json", self.users_data)
+
+    def iter_roles(self, chat_id: int) -> Iterator[Tuple[int, List[str]]]:
+        for user_key, user_data in self.users_data.items():
+            key_chat, _, key_user = user_key.rpartition('_')
+            if key_chat == str(chat_id):
+                yield int(key_user), user_data.get("roles", [])
+
+    def count_users(self) -> int:
+        return len(self.users_data)
+
+    def get_warnings(self, chat_id: int, user_id: int) -> List[Dict]:
+        return self.warnings_data.get(str(chat_id), {}).get(str(user_id), [])
+
+    def add_warning(self, chat_id: int, user_id: int, warning: Dict) -> int:
+        return self.warnings_journal.add(str(chat_id), str(user_id), warning)
+
+    def clear_warnings(self, chat_id: int, user_id: int) -> bool:
+        return self.warnings_journal.clear(str(chat_id), str(user_id))
+
+    def reload(self) -> None:
+        self.store.flush()
+        self.group_keys = self._load_group_keys()
+        self.users_data = self.load_json_file("users.json", {})
+        if self.warnings_journal is not None:
+            self.warnings_journal.close()
+        self.warnings_journal = WarningsJournal(self.data_dir)
+        self.warnings_data = self.warnings_journal.open()
+
+    def flush(self) -> None:
+        self.store.flush()
+
+    def close(self) -> None:
+        self.store.close()
+        self.warnings_journal.close()
+
+class SQLiteStorageBackend(StorageBackend):
+    """Storage in a WAL-mode SQLite database with one row per record"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_roles (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            roles TEXT NOT NULL,
+            PRIMARY KEY (chat_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reason TEXT,
+            date TEXT NOT NULL,
+            warned_by INTEGER,
+            warned_by_name TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_warnings_chat_user ON warnings (chat_id, user_id);
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._import_json_files()
+        logger.info(f"✅ Opened SQLite storage at {db_path}")
+
+    def _import_json_files(self) -> None:
+        """One-time migration from the JSON files into an empty database"""
+        if self.conn.execute("SELECT 1 FROM groups LIMIT 1").fetchone():
+            return
+        if self.conn.execute("SELECT 1 FROM user_roles LIMIT 1").fetchone():
+            return
+        if self.conn.execute("SELECT 1 FROM warnings LIMIT 1").fetchone():
+            return
+
+        data_dir = self.db_path.parent
+
+        def read(filename: str) -> Dict:
+            try:
+                with open(data_dir / filename, 'r', encoding='utf-8') as f:
+                    return json.load(f) or {}
+            except (OSError, json.JSONDecodeError):
+                return {}
+
+        groups, users = read("groups.json"), read("users.json")
+        warnings = WarningsJournal.read_state(data_dir)
+        shard_dir = data_dir / JsonStorageBackend.GROUPS_DIR
+        if shard_dir.is_dir():
+            for shard in shard_dir.glob("*.json"):
+                groups[shard.stem] = read(f"{JsonStorageBackend.GROUPS_DIR}/{shard.name}")
+        if not (groups or users or warnings):
+            return
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO groups (chat_id, data) VALUES (?, ?)",
+                [(int(k), json.dumps(v, ensure_ascii=False)) for k, v in groups.items()]
+            )
+            for user_key, user_data in users.items():
+                chat_id, _, user_id = user_key.rpartition('_')
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO user_roles (chat_id, user_id, roles) VALUES (?, ?, ?)",
+                    (int(chat_id), int(user_id), json.dumps(user_data.get("roles", [])))
+                )
+            for chat_key, chat_warnings in warnings.items():
+                for user_key, user_warnings in chat_warnings.items():
+                    for warning in user_warnings:
+                        self._insert_warning(int(chat_key), int(user_key), warning)
+        logger.info(f"📦 Imported {len(groups)} groups and {len(users)} role records into SQLite")
+
+    def get_group(self, chat_key: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT data FROM groups WHERE chat_id = ?", (int(chat_key),)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def save_group(self, chat_key: str, data: Dict) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO groups (chat_id, data) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data",
+                (int(chat_key), json.dumps(data, ensure_ascii=False))
+            )
+
+    def count_groups(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
+
+    def get_roles(self, chat_id: int, user_id: int) -> List[str]:
+        row = self.conn.execute(
+            "SELECT roles FROM user_roles WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()
+        return json.loads(row["roles"]) if row else []
+
+    def set_roles(self, chat_id: int, user_id: int, roles: List[str]) -> None:
+        with self.conn:
+            if roles:
+                self.conn.execute(
+                    "INSERT INTO user_roles (chat_id, user_id, roles) VALUES (?, ?, ?) "
+                    "ON CONFLICT (chat_id, user_id) DO UPDATE SET roles = excluded.roles",
+                    (chat_id, user_id, json.dumps(list(roles)))
+                )
+            else:
+                self.conn.execute(
+                    "DELETE FROM user_roles WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+                )
+
+    def iter_roles(self, chat_id: int) -> Iterator[Tuple[int, List[str]]]:
+        rows = self.conn.execute(
+            "SELECT user_id, roles FROM user_roles WHERE chat_id = ?", (chat_id,)
+        ).fetchall()
+        for row in rows:
+            yield row["user_id"], json.loads(row["roles"])
+
+    def count_users(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM user_roles").fetchone()[0]
+
+    def get_warnings(self, chat_id: int, user_id: int) -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT reason, date, warned_by, warned_by_name FROM warnings "
+            "WHERE chat_id = ? AND user_id = ? ORDER BY id",
+            (chat_id, user_id)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _insert_warning(self, chat_id: int, user_id: int, warning: Dict) -> None:
+        self.conn.execute(
+            "INSERT INTO warnings (chat_id, user_id, reason, date, warned_by, warned_by_name) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, user_id, warning.get("reason"), warning.get("date"),
+             warning.get("warned_by"), warning.get("warned_by_name"))
+        )
+
+    def add_warning(self, chat_id: int, user_id: int, warning: Dict) -> int:
+        with self.conn:
+            self._insert_warning(chat_id, user_id, warning)
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM warnings WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()[0]
+
+    def clear_warnings(self, chat_id: int, user_id: int) -> bool:
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM warnings WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+            )
+        return cursor.rowcount > 0
+
+    def close(self) -> None:
+        self.conn.close()
+
+class GroupSettingsCache:
+    """Bounded LRU of loaded group settings in front of the storage backend"""
+
+    def __init__(self, storage: StorageBackend, max_chats: int = 500):
+        self.storage = storage
+        self.max_chats = max_chats
+        self._groups: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def get(self, chat_key: str) -> Optional[Dict]:
+        group = self._groups.get(chat_key)
+        if group is not None:
+            self._groups.move_to_end(chat_key)
+            return group
+
+        group = self.storage.get_group(chat_key)
+        if group is not None:
+            self._add(chat_key, group)
+        return group
+
+    def put(self, chat_key: str, group: Dict) -> None:
+        self.storage.save_group(chat_key, group)
+        self._add(chat_key, group)
+
+    def clear(self) -> None:
+        while self._groups:
+            chat_key, _ = self._groups.popitem(last=False)
+            self.storage.release_group(chat_key)
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def _add(self, chat_key: str, group: Dict) -> None:
+        self._groups[chat_key] = group
+        self._groups.move_to_end(chat_key)
+        while len(self._groups) > self.max_chats:
+            idle_key, _ = self._groups.popitem(last=False)
+            self.storage.release_group(idle_key)
+
+def create_storage_backend(data_dir: Path, backend: str) -> StorageBackend:
+    """Create the storage backend selected by name ('json' or 'sqlite')"""
+    if backend == "sqlite":
+        return SQLiteStorageBackend(data_dir / "bot.db")
+    if backend != "json":
+        logger.warning(f"⚠️ Unknown storage backend '{backend}', using json")
+    return JsonStorageBackend(data_dir)
+
+class ActionLog:
+    """Rotating JSONL moderation log with a per-chat offset index.
+
+    Each segment actions.log[.N] has a companion actions.idx[.N] of fixed
+    (chat_id, offset) records. Looking up a chat's latest entries reads the
+    index backwards block by block and then seeks straight to those lines,
+    so /log does not depend on how large the log has grown.
+    """
+
+    RECORD = struct.Struct('<qQ')
+    BLOCK_RECORDS = 4096
+
+    def __init__(self, data_dir: Path, max_bytes: int = 5 * 1024 * 1024,
+                 max_age: float = 86400, backup_count: int = 5, max_cached_chats: int = 1000):
+        self.log_path = data_dir / "actions.log"
+        self.idx_path = data_dir / "actions.idx"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backup_count = backup_count
+        self.max_cached_chats = max_cached_chats
+        self.generation = 0
+        self._lock = threading.Lock()
+        # chat_id -> newest (generation, offset) refs, and whether they reach the start of history
+        self._recent: "OrderedDict[int, Tuple[deque, bool]]" = OrderedDict()
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        if self.log_path.exists() and not self.idx_path.exists():
+            self._rebuild_index()
+        self._log = open(self.log_path, 'ab')
+        self._idx = open(self.idx_path, 'ab')
+        self._segment_started = time.time()
+        if self._log.tell():
+            try:
+                with open(self.log_path, 'rb') as f:
+                    first = json.loads(f.readline())
+                self._segment_started = datetime.fromisoformat(first["timestamp"]).timestamp()
+            except (ValueError, KeyError):
+                pass
+
+    def _rebuild_index(self) -> None:
+        """Index a log written before indexing existed"""
+        with open(self.log_path, 'rb') as log, open(self.idx_path, 'wb') as idx:
+            offset = 0
+            for line in log:
+                try:
+                    chat_id = int(json.loads(line).get("chat_id") or 0)
+                except (ValueError, TypeError):
+                    chat_id = 0
+                idx.write(self.RECORD.pack(chat_id, offset))
+                offset += len(line)
+        logger.info("📇 Built index for existing actions.log")
+
+    def _segment_paths(self, age: int) -> Tuple[Path, Path]:
+        if age == 0:
+            return self.log_path, self.idx_path
+        return (self.log_path.with_name(f"{self.log_path.name}.{age}"),
+                self.idx_path.with_name(f"{self.idx_path.name}.{age}"))
+
+    def _rotate(self) -> None:
+        self._log.close()
+        self._idx.close()
+        for age in range(self.backup_count, 0, -1):
+            src_log, src_idx = self._segment_paths(age - 1)
+            dst_log, dst_idx = self._segment_paths(age)
+            for src, dst in ((src_log, dst_log), (src_idx, dst_idx)):
+                if src.exists():
+                    os.replace(src, dst)
+        self.generation += 1
+        self._open_segment()
+
+    def append(self, entry: Dict) -> None:
+        self.append_many([entry])
+
+    def append_many(self, entries: List[Dict]) -> None:
+        """Write a batch of entries with a single flush"""
+        with self._lock:
+            for entry in entries:
+                line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+                chat_id = int(entry.get("chat_id") or 0)
+                size = self._log.tell()
+                if size and (size + len(line) > self.max_bytes
+                             or time.time() - self._segment_started > self.max_age):
+                    self._rotate()
+                    size = 0
+                self._log.write(line)
+                self._idx.write(self.RECORD.pack(chat_id, size))
+
+                cached = self._recent.get(chat_id)
+                if cached is not None:
+                    cached[0].append((self.generation, size))
+            self._log.flush()
+            self._idx.flush()
+
+    def recent(self, chat_id: int, limit: int = 10) -> List[Dict]:
+        """Return up to limit newest entries for a chat, oldest first"""
+        with self._lock:
+            cached = self._recent.get(chat_id)
+            if cached is None or (len(cached[0]) < limit
+                                  and (not cached[1] or len(cached[0]) == cached[0].maxlen)):
+                refs, complete = self._scan_index(chat_id, limit)
+                cached = (deque(refs, maxlen=max(limit, 50)), complete)
+                self._recent[chat_id] = cached
+                while len(self._recent) > self.max_cached_chats:
+                    self._recent.popitem(last=False)
+            self._recent.move_to_end(chat_id)
+            refs = list(cached[0])[-limit:]
+            return self._read_entries(refs)
+
+    def _scan_index(self, chat_id: int, limit: int) -> Tuple[List[Tuple[int, int]], bool]:
+        """Walk index segments newest-first, reading each backwards in blocks"""
+        found: List[Tuple[int, int]] = []
+        block_bytes = self.RECORD.size * self.BLOCK_RECORDS
+        for age in range(self.backup_count + 1):
+            _, idx_path = self._segment_paths(age)
+            if not idx_path.exists():
+                continue
+            with open(idx_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell() - f.tell() % self.RECORD.size
+                while end > 0:
+                    start = max(0, end - block_bytes)
+                    f.seek(start)
+                    block = f.read(end - start)
+                    for rec_chat, offset in reversed(list(self.RECORD.iter_unpack(block))):
+                        if rec_chat == chat_id:
+                            found.append((self.generation - age, offset))
+                            if len(found) >= limit:
+                                return found[::-1], False
+                    end = start
+        return found[::-1], True
+
+    def _read_entries(self, refs: List[Tuple[int, int]]) -> List[Dict]:
+        entries = []
+        self._log.flush()
+        handles: Dict[int, Any] = {}
+        try:
+            for generation, offset in refs:
+                age = self.generation - generation
+                if age > self.backup_count:
+                    continue
+                if age not in handles:
+                    log_path, _ = self._segment_paths(age)
+                    if not log_path.exists():
+                        continue
+                    handles[age] = open(log_path, 'rb')
+                f = handles[age]
+                f.seek(offset)
+                try:
+                    entries.append(json.loads(f.readline()))
+                except ValueError:
+                    continue
+        finally:
+            for f in handles.values():
+                f.close()
+        return entries
+
+    def close(self) -> None:
+        with self._lock:
+            self._log.close()
+            self._idx.close()
+
+class BufferedActionLogger:
+    """Queues action log entries and writes them in batches off the event loop"""
+
+    def __init__(self, action_log: ActionLog, max_queue: int = 10000, flush_interval: float = 0.5):
+        self.action_log = action_log
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._reported_dropped = 0
+        # Entries, flush markers (Events set once everything before them is
+        # written) and None to stop
+        self._queue: "queue.Queue[Optional[Dict | threading.Event]]" = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="action-log", daemon=True)
+        self._thread.start()
+
+    def log(self, entry: Dict) -> None:
+        """Queue an entry; never blocks, drops the entry if the buffer is full"""
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the entries queued before this call have been written.
+
+        Waits on a marker rather than for the queue to drain, so entries
+        that keep arriving (e.g. during a raid) cannot hold it up.
+        """
+        marker = threading.Event()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def recent(self, chat_id: int, limit: int = 10) -> List[Dict]:
+        if not self.flush():
+            logger.warning("⚠️ Action log flush timed out; showing entries written so far")
+        return self.action_log.recent(chat_id, limit)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.action_log.close()
+
+    def _run(self) -> None:
+        while True:
+            entry = self._queue.get()
+            batch = [entry]
+            # Give a burst time to accumulate, then drain it in one write
+            time.sleep(self.flush_interval)
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            entries = [e for e in batch if isinstance(e, dict)]
+            markers = [e for e in batch if isinstance(e, threading.Event)]
+            try:
+                if entries:
+                    self.action_log.append_many(entries)
+            except Exception as e:
+                logger.error(f"Failed to write action log batch: {e}")
+            finally:
+                for marker in markers:
+                    marker.set()
+                for _ in batch:
+                    self._queue.task_done()
+
+            if self.dropped != self._reported_dropped:
+                logger.warning(f"⚠️ Action log buffer full, dropped {self.dropped - self._reported_dropped} entries")
+                self._reported_dropped = self.dropped
+            if stop:
+                break
 
 class GroupMegBot:
     def __init__(self):
@@ -244,21 +2770,94 @@ class GroupMegBot:
         
         # Load configuration
         self.config = self.load_config()
+        self.anti_spam.configure(self.config.get("anti_spam", {}))
         
-        # Initialize data storage
-        self.groups_data = self.load_json_file("groups.json", {})
-        self.users_data = self.load_json_file("users.json", {})
-        self.warnings_data = self.load_json_file("warnings.json", {})
+        # Initialize data storage (STORAGE_BACKEND=json|sqlite)
+        self.storage = create_storage_backend(
+            self.data_dir,
+            os.getenv('STORAGE_BACKEND', self.config.get('storage_backend', 'json')).lower()
+        )
+        self.group_cache = GroupSettingsCache(
+            self.storage, int(self.config.get('max_cached_groups', 500))
+        )
+        
+        # Moderation action log (rotated, indexed per chat)
+        log_settings = self.config.get('action_log', {})
+        self.action_logger = BufferedActionLogger(
+            ActionLog(
+                self.data_dir,
+                max_bytes=int(log_settings.get('max_bytes', 5 * 1024 * 1024)),
+                max_age=float(log_settings.get('max_age_hours', 24)) * 3600,
+                backup_count=int(log_settings.get('backup_count', 5))
+            ),
+            max_queue=int(log_settings.get('max_queue', 10000))
+        )
+        
+        # Runtime state that workers share (STATE_BACKEND=memory|sqlite): flood
+        # and join windows, statistics counters and raid lockdowns
+        self.state = create_state_backend(
+            self.data_dir,
+            os.getenv('STATE_BACKEND', self.config.get('state_backend', 'memory')).lower()
+        )
+        
+        # Per-chat budget for the bot's own flood notices so a flood does not make it flood too
+        self.notice_limiter = RateLimiter(RateLimiter.TOKEN_BUCKET)
+        
+        # Raid lockdowns are "lockdown:<chat_id>" -> {"until": wall-clock end,
+        # "permissions": the chat's permissions before the lockdown} in the state backend
+        self._lockdown_tasks: Dict[int, asyncio.Task] = {}
+        
+        # Anti-spam and rate-limit state survives restarts via periodic snapshots.
+        # Each worker keeps its own chats' anti-spam state, so with several
+        # workers (WORKER_ID=0, 1, ...) each one snapshots to its own file
+        worker_id = os.getenv('WORKER_ID', str(self.config.get('worker_id', ''))).strip()
+        if worker_id:
+            self.state_file = self.data_dir / f"antispam_state.{worker_id}.json"
+        else:
+            self.state_file = self.data_dir / "antispam_state.json"
+            if self.state.blocking:
+                logger.warning("⚠️ Shared state backend without WORKER_ID: workers will overwrite each other's snapshots")
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self.load_state_snapshot()
+        
+        # Bulk domain blocklists from data/blocklists/*.txt
+        self.load_blocklist()
         
         # Bot statistics
-        self.stats = {
-            "commands_used": 0,
-            "groups_managed": len(self.groups_data),
-            "users_registered": len(self.users_data),
-            "messages_filtered": 0,
-            "spam_blocked": 0,
-            "start_time": datetime.now().isoformat()
-        }
+        self.stats = BotStats(
+            self.state,
+            groups_managed=self.storage.count_groups(),
+            users_registered=self.storage.count_users(),
+            start_time=datetime.now().isoformat()
+        )
+
+    def load_blocklist(self) -> None:
+        """Build (if the source lists changed), map and install the domain blocklist"""
+        self.content_filter.set_blocklist(self.open_blocklist())
+
+    def open_blocklist(self) -> Optional[DomainBlocklist]:
+        """Build (if the source lists changed) and map the domain blocklist.
+
+        Touches no shared state, so it can run on a worker thread; the
+        result is installed with ContentFilter.set_blocklist on the loop.
+        """
+        settings = self.config.get('blocklists', {})
+        blocklist = DomainBlocklist(
+            self.data_dir / "blocklists",
+            self.data_dir / "blocklists.bin",
+            false_positive_rate=float(settings.get('false_positive_rate', 0.001)),
+            exact=bool(settings.get('exact', False))
+        )
+        try:
+            loaded = blocklist.load()
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Error loading domain blocklist: {e}")
+            blocklist.close()
+            loaded = False
+        if not loaded:
+            return None
+        logger.info(f"Domain blocklist loaded: {len(blocklist):,} domains")
+        return blocklist
 
     def load_config(self) -> Dict[str, Any]:
         """Load bot configuration from config.json"""
@@ -307,6 +2906,21 @@ class GroupMegBot:
                 "auto_mute_spammers": True,
                 "spam_detection_sensitivity": "medium"
             },
+            "anti_flood": {
+                "enabled": True,
+                "limit": 10,
+                "window": 10,
+                "action": "mute",
+                "chat_limit": 60,
+                "chat_window": 10
+            },
+            "anti_raid": {
+                "enabled": True,
+                "join_limit": 15,
+                "window": 60,
+                "lockdown_minutes": 10
+            },
+            "state_snapshot_interval": 60,
             "role_permissions": {
                 "owner": ["all"],
                 "admin": ["warn", "kick", "ban", "mute", "delete", "manage_rules", "settings"],
@@ -329,40 +2943,91 @@ class GroupMegBot:
             }
         }
 
-    def load_json_file(self, filename: str, default: Any) -> Any:
-        """Load JSON file with default fallback"""
-        filepath = self.data_dir / filename
-        try:
-            if filepath.exists():
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logger.info(f"✅ Loaded {filename} successfully")
-                    return data
-            else:
-                logger.info(f"📁 {filename} not found, creating with defaults")
-                self.save_json_file(filename, default)
-                return default
-        except json.JSONDecodeError as e:
-            logger.warning(f"⚠️ Invalid JSON in {filename}, using defaults: {e}")
-            return default
-        except Exception as e:
-            logger.warning(f"⚠️ Could not load {filename}, using defaults: {e}")
-            return default
+    async def post_init(self, application: Application) -> None:
+        """Start background work that needs the running application"""
+        # Chats still locked from before the restart get their unlock rescheduled
+        # (with a shared backend only one worker wins the claim in _lift_lockdown)
+        for key, marker in await self._state_call(self.state.scan, "lockdown:"):
+            chat_id = int(key.split(":", 1)[1])
+            end = marker["until"] if isinstance(marker, dict) else marker
+            self._lockdown_tasks[chat_id] = asyncio.create_task(
+                self._lift_lockdown(application.bot, chat_id, max(end - time.time(), 0))
+            )
+        # Counter totals (all workers' with a shared backend) for /stats
+        await asyncio.to_thread(self.stats.flush)
+        self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+
+    async def _state_call(self, fn, *args):
+        """Call a state backend method, off the event loop if the backend can block"""
+        if self.state.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _state_snapshot(self) -> Dict[str, Any]:
+        """Anti-spam, flood and raid state with wall-clock timestamps (rows generated lazily)"""
+        clock_offset = time.time() - time.monotonic()
+        snapshot = {
+            "version": 2,
+            "saved_at": time.time(),
+            "anti_spam": self.anti_spam.export_state(clock_offset)
+        }
+        state = self.state.export_state(clock_offset)
+        if state is not None:
+            snapshot["state"] = state
+        return snapshot
 
-    def save_json_file(self, filename: str, data: Any) -> None:
-        """Save data to JSON file"""
-        filepath = self.data_dir / filename
+    def save_state_snapshot(self) -> None:
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Error saving {filename}: {e}")
+            atomic_write_text(self.state_file, json_chunks(self._state_snapshot()))
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Error saving anti-spam state: {e}")
+
+    async def _snapshot_loop(self) -> None:
+        interval = float(self.config.get("state_snapshot_interval", 60))
+        while True:
+            await asyncio.sleep(interval)
+            # Export, serialize and write in a thread; the export copies each
+            # container in one step and is encoded in short batches, so the
+            # event loop keeps running throughout
+            await asyncio.to_thread(self.save_state_snapshot)
+            try:
+                await asyncio.to_thread(self.stats.flush)
+                await asyncio.to_thread(self.state.prune)
+            except (OSError, TypeError, ValueError, sqlite3.Error) as e:
+                logger.error(f"Error flushing stats or pruning state: {e}")
+
+    def load_state_snapshot(self) -> None:
+        """Restore the last snapshot, dropping entries that expired while we were down"""
+        if not self.state_file.exists():
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            clock_offset = time.time() - time.monotonic()
+            self.anti_spam.restore_state(state.get("anti_spam", {}), clock_offset)
+            if "state" in state:
+                self.state.restore_state(state["state"], clock_offset)
+            logger.info(f"Restored anti-spam state saved {time.time() - state.get('saved_at', time.time()):.0f}s ago")
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.error(f"Error loading anti-spam state: {e}")
+
+    def shutdown(self) -> None:
+        """Flush pending data to disk before exit"""
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+        self.save_state_snapshot()
+        self.stats.flush()
+        self.state.close()
+        self.storage.close()
+        self.action_logger.close()
+        self.content_filter.set_blocklist(None)
 
     def get_group_settings(self, chat_id: int) -> Dict:
         """Get group-specific settings"""
         chat_key = str(chat_id)
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {
+        group = self.group_cache.get(chat_key)
+        if group is None:
+            group = {
                 "rules": self.config["default_rules"].copy(),
                 "settings": {
                     "content_filtering_enabled": True,
@@ -376,16 +3041,33 @@ class GroupMegBot:
                 "warnings": {},
                 "banned_words": [],
                 "allowed_domains": [],
-                "blocked_domains": []
+                "blocked_domains": [],
+                "anti_spam": {}
             }
-            self.save_json_file("groups.json", self.groups_data)
+            self.group_cache.put(chat_key, group)
         
-        return self.groups_data[chat_key]
+        return group
+
+    FLOOD_ACTIONS = ("delete", "warn", "mute", "kick", "ban")
+
+    def get_flood_settings(self, group: Dict) -> Dict[str, Any]:
+        """The group's anti-flood settings over the global defaults"""
+        defaults = {"enabled": True, "limit": 10, "window": 10, "action": "mute",
+                    "chat_limit": 60, "chat_window": 10}
+        return {**defaults, **self.config.get("anti_flood", {}), **group.get("antiflood", {})}
+
+    def get_raid_settings(self, group: Dict) -> Dict[str, Any]:
+        """The group's anti-raid settings over the global defaults"""
+        defaults = {"enabled": True, "join_limit": 15, "window": 60, "lockdown_minutes": 10}
+        return {**defaults, **self.config.get("anti_raid", {}), **group.get("antiraid", {})}
+
+    def save_group_settings(self, chat_id: int, group: Dict) -> None:
+        """Persist changes made to a group's settings"""
+        self.group_cache.put(str(chat_id), group)
 
     def get_user_roles(self, user_id: int, chat_id: int) -> List[str]:
         """Get user roles for a specific chat"""
-        user_key = f"{chat_id}_{user_id}"
-        return self.users_data.get(user_key, {}).get("roles", [])
+        return self.storage.get_roles(chat_id, user_id)
 
     def has_permission(self, user_id: int, chat_id: int, permission: str) -> bool:
         """Check if user has specific permission"""
@@ -464,7 +3146,7 @@ class GroupMegBot:
         user = update.effective_user
         chat = update.effective_chat
         
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         if chat.type == "private":
             welcome_text = f"""
@@ -529,7 +3211,7 @@ Use /menu to access all features or /help for command list.
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """❓ Help command handler"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         help_text = """
 🆘 **GROUP MEG Bot - Command Help** 🇵🇸
@@ -588,7 +3270,10 @@ Use /menu to access all features or /help for command list.
 • /restrict [reply/user_id] - ⚠️ Restrict user
 • /detectspam - 🔍 Scan recent spam messages
 • /antispam on|off - 🛡️ Toggle anti-spam filter
-• /antiflood on|off - 🌊 Toggle anti-flood controls
+• /spampolicy [setting value] - 🎚️ Tune anti-spam thresholds
+• /antiflood on|off [limit] [window] [action] - 🌊 Toggle anti-flood controls
+• /antiflood chat <limit|off> [window] - 👥 Limit the whole group's message rate
+• /antiraid on|off [joins] [window] [minutes] - 🚨 Join-burst lockdown
 • /log - 📜 Show recent group events
 
 👥 **Member Management:**
@@ -600,6 +3285,8 @@ Use /menu to access all features or /help for command list.
 📝 **Content & Rules:**
 • /antinsfw on|off - 🚫 Adult content filter
 • /antilink on|off - 🔗 Block external links
+• /addword /delword <words> - 🚫 Group banned words
+• /blockdomain /allowdomain <domains> - 🌐 Group domain lists
 
 💾 **Storage & Export:**
 • /backup - 📦 Export group settings
@@ -639,7 +3326,7 @@ Use /menu to access all features or /help for command list.
 
     async def about_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ℹ️ About command handler"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         about_text = f"""
 🤖 **About GROUP MEG Bot** 🇵🇸
@@ -704,7 +3391,7 @@ Use /menu to access all features or /help for command list.
 
     async def menu_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """🎛️ Open interactive menu"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         menu_text = """
 🎛️ **GROUP MEG Bot - Main Menu** 🇵🇸
@@ -733,7 +3420,7 @@ Choose a category to explore:
         if not update.effective_chat:
             return
             
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         group_settings = self.get_group_settings(update.effective_chat.id)
         rules = group_settings.get("rules", self.config["default_rules"])
         
@@ -768,12 +3455,9 @@ Choose a category to explore:
         rules_text = " ".join(context.args)
         rules_list = [rule.strip() for rule in rules_text.split('\n') if rule.strip()]
         
-        chat_key = str(update.effective_chat.id)
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {}
-        
-        self.groups_data[chat_key]["rules"] = rules_list
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["rules"] = rules_list
+        self.save_group_settings(update.effective_chat.id, group)
         
         await update.message.reply_text(
             f"✅ **Rules Updated Successfully!**\n\n"
@@ -966,15 +3650,6 @@ Choose a category to explore:
         user_to_warn = update.message.reply_to_message.from_user
         reason = " ".join(context.args) if context.args else "No reason provided"
         
-        # Get or create warning data
-        chat_key = str(update.effective_chat.id)
-        if chat_key not in self.warnings_data:
-            self.warnings_data[chat_key] = {}
-        
-        user_key = str(user_to_warn.id)
-        if user_key not in self.warnings_data[chat_key]:
-            self.warnings_data[chat_key][user_key] = []
-        
         # Add warning
         warning = {
             "reason": reason,
@@ -983,11 +3658,7 @@ Choose a category to explore:
             "warned_by_name": update.effective_user.first_name
         }
         
-        self.warnings_data[chat_key][user_key].append(warning)
-        warn_count = len(self.warnings_data[chat_key][user_key])
-        
-        # Save warnings
-        self.save_json_file("warnings.json", self.warnings_data)
+        warn_count, banned = await self._add_warning(context.bot, update.effective_chat.id, user_to_warn.id, warning)
         
         warn_text = f"⚠️ **User Warned**\n\n"
         warn_text += f"👤 User: {user_to_warn.first_name}\n"
@@ -999,16 +3670,31 @@ Choose a category to explore:
         # Check if limit reached
         if warn_count >= self.config['warn_limit']:
             warn_text += f"\n\n🚨 **Warning limit reached!**"
-            if self.config.get('auto_ban_on_violations', False):
-                try:
-                    await context.bot.ban_chat_member(update.effective_chat.id, user_to_warn.id)
-                    warn_text += f"\n🔨 User has been banned automatically."
-                except:
-                    warn_text += f"\n❌ Failed to auto-ban user."
+            if banned is True:
+                warn_text += f"\n🔨 User has been banned automatically."
+            elif banned is False:
+                warn_text += f"\n❌ Failed to auto-ban user."
         
         await update.message.reply_text(warn_text, parse_mode=ParseMode.MARKDOWN)
         self._log_action(update.effective_chat.id, "warn", update.effective_user.id, user_to_warn.id, reason)
 
+    async def _add_warning(self, bot, chat_id: int, user_id: int, warning: Dict) -> Tuple[int, Optional[bool]]:
+        """Store a warning and enforce the warn limit.
+        
+        Returns the new warning count and whether the user was auto-banned
+        (None when the limit was not reached or auto-ban is off).
+        """
+        warn_count = self.storage.add_warning(chat_id, user_id, warning)
+        banned = None
+        if warn_count >= self.config['warn_limit'] and self.config.get('auto_ban_on_violations', False):
+            try:
+                await bot.ban_chat_member(chat_id, user_id)
+                banned = True
+            except TelegramError as e:
+                logger.error(f"Failed to auto-ban user {user_id} in chat {chat_id}: {e}")
+                banned = False
+        return warn_count, banned
+
     async def warnings_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """📋 Show user warnings"""
         if not update.message.reply_to_message:
@@ -1016,15 +3702,12 @@ Choose a category to explore:
             return
         
         user = update.message.reply_to_message.from_user
-        chat_key = str(update.effective_chat.id)
-        user_key = str(user.id)
+        warnings = self.storage.get_warnings(update.effective_chat.id, user.id)
         
-        if chat_key not in self.warnings_data or user_key not in self.warnings_data[chat_key]:
+        if not warnings:
             await update.message.reply_text(f"✅ {user.first_name} has no warnings.")
             return
         
-        warnings = self.warnings_data[chat_key][user_key]
-        
         warn_text = f"⚠️ **Warnings for {user.first_name}**\n\n"
         warn_text += f"📊 Total Warnings: **{len(warnings)}/{self.config['warn_limit']}**\n\n"
         
@@ -1049,13 +3732,8 @@ Choose a category to explore:
             return
         
         user = update.message.reply_to_message.from_user
-        chat_key = str(update.effective_chat.id)
-        user_key = str(user.id)
         
-        if chat_key in self.warnings_data and user_key in self.warnings_data[chat_key]:
-            del self.warnings_data[chat_key][user_key]
-            self.save_json_file("warnings.json", self.warnings_data)
-            
+        if self.storage.clear_warnings(update.effective_chat.id, user.id):
             await update.message.reply_text(
                 f"🧽 **Warnings Cleared**\n\n"
                 f"👤 User: {user.first_name}\n"
@@ -1136,13 +3814,10 @@ Choose a category to explore:
             await update.message.reply_text(f"❌ Invalid role. Available: {available_roles}")
             return
         
-        user_key = f"{update.effective_chat.id}_{user.id}"
-        if user_key not in self.users_data:
-            self.users_data[user_key] = {"roles": []}
+        roles = self.get_user_roles(user.id, update.effective_chat.id)
         
-        if role not in self.users_data[user_key]["roles"]:
-            self.users_data[user_key]["roles"].append(role)
-            self.save_json_file("users.json", self.users_data)
+        if role not in roles:
+            self.storage.set_roles(update.effective_chat.id, user.id, roles + [role])
             
             await update.message.reply_text(
                 f"👑 **Role Added**\n\n"
@@ -1166,11 +3841,10 @@ Choose a category to explore:
         
         role = context.args[0].lower()
         user = update.message.reply_to_message.from_user
-        user_key = f"{update.effective_chat.id}_{user.id}"
+        roles = self.get_user_roles(user.id, update.effective_chat.id)
         
-        if user_key in self.users_data and role in self.users_data[user_key]["roles"]:
-            self.users_data[user_key]["roles"].remove(role)
-            self.save_json_file("users.json", self.users_data)
+        if role in roles:
+            self.storage.set_roles(update.effective_chat.id, user.id, [r for r in roles if r != role])
             
             await update.message.reply_text(
                 f"👤 **Role Removed**\n\n"
@@ -1254,13 +3928,9 @@ Choose a category to explore:
             return
         
         welcome_msg = " ".join(context.args)
-        chat_key = str(update.effective_chat.id)
-        
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {}
-        
-        self.groups_data[chat_key]["welcome_message"] = welcome_msg
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["welcome_message"] = welcome_msg
+        self.save_group_settings(update.effective_chat.id, group)
         
         await update.message.reply_text(
             f"🎉 **Welcome Message Set!**\n\n"
@@ -1283,13 +3953,9 @@ Choose a category to explore:
             return
         
         goodbye_msg = " ".join(context.args)
-        chat_key = str(update.effective_chat.id)
-        
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {}
-        
-        self.groups_data[chat_key]["goodbye_message"] = goodbye_msg
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["goodbye_message"] = goodbye_msg
+        self.save_group_settings(update.effective_chat.id, group)
         
         await update.message.reply_text(
             f"👋 **Goodbye Message Set!**\n\n"
@@ -1360,10 +4026,9 @@ Choose a category to explore:
                 info_text += f"📅 Joined: {member.until_date.strftime('%Y-%m-%d')}\n"
             
             # Show warnings
-            chat_key = str(update.effective_chat.id)
-            user_key = str(user.id)
-            if chat_key in self.warnings_data and user_key in self.warnings_data[chat_key]:
-                warn_count = len(self.warnings_data[chat_key][user_key])
+            warnings = self.storage.get_warnings(update.effective_chat.id, user.id)
+            if warnings:
+                warn_count = len(warnings)
                 info_text += f"⚠️ Warnings: {warn_count}/{self.config['warn_limit']}\n"
             
             await update.message.reply_text(info_text, parse_mode=ParseMode.MARKDOWN)
@@ -1442,10 +4107,8 @@ Choose a category to explore:
                     profile_text += "• Promote members ✅\n"
             
             # Warning history
-            chat_key = str(update.effective_chat.id)
-            user_key = str(user.id)
-            if chat_key in self.warnings_data and user_key in self.warnings_data[chat_key]:
-                warnings = self.warnings_data[chat_key][user_key]
+            warnings = self.storage.get_warnings(update.effective_chat.id, user.id)
+            if warnings:
                 profile_text += f"⚠️ **Warnings:** {len(warnings)}/{self.config['warn_limit']}\n"
                 
                 if warnings:
@@ -1464,7 +4127,7 @@ Choose a category to explore:
     
     async def quote_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """💭 Send motivational quote"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         quotes = [
             "💪 The only way to do great work is to love what you do. - Steve Jobs",
@@ -1489,7 +4152,7 @@ Choose a category to explore:
 
     async def joke_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """😄 Tell a random joke"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         jokes = [
             "Why don't scientists trust atoms? 🧪\nBecause they make up everything!",
@@ -1511,7 +4174,7 @@ Choose a category to explore:
 
     async def cat_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """🐱 Send random cat fact"""
-        self.stats["commands_used"] += 1
+        self.stats.incr("commands_used")
         
         cat_facts = [
             "🐱 Cats sleep 12-16 hours per day!",
@@ -1568,8 +4231,7 @@ Choose a category to explore:
             return
         
         try:
-            permissions = ChatPermissions(can_send_messages=False)
-            await context.bot.set_chat_permissions(update.effective_chat.id, permissions)
+            await self._set_chat_locked(context.bot, update.effective_chat.id, True)
             
             await update.message.reply_text(
                 "🔒 **Group Locked**\n\n"
@@ -1588,13 +4250,13 @@ Choose a category to explore:
             return
         
         try:
-            permissions = ChatPermissions(
-                can_send_messages=True,
-                can_send_media_messages=True,
-                can_send_other_messages=True,
-                can_add_web_page_previews=True
-            )
-            await context.bot.set_chat_permissions(update.effective_chat.id, permissions)
+            await self._set_chat_locked(context.bot, update.effective_chat.id, False)
+            
+            # A manual unlock also ends an automatic raid lockdown
+            task = self._lockdown_tasks.pop(update.effective_chat.id, None)
+            if task:
+                task.cancel()
+            await self._state_call(self.state.delete, f"lockdown:{update.effective_chat.id}")
             
             await update.message.reply_text(
                 "🔓 **Group Unlocked**\n\n"
@@ -1605,6 +4267,26 @@ Choose a category to explore:
         except Exception as e:
             await update.message.reply_text(f"❌ Failed to unlock group: {str(e)}")
 
+    async def _set_chat_locked(self, bot, chat_id: int, locked: bool) -> None:
+        """Apply the /lock or /unlock member permissions to a chat"""
+        if locked:
+            permissions = ChatPermissions(can_send_messages=False)
+        else:
+            # python-telegram-bot 20 replaced can_send_media_messages with per-type flags
+            permissions = ChatPermissions(
+                can_send_messages=True,
+                can_send_audios=True,
+                can_send_documents=True,
+                can_send_photos=True,
+                can_send_videos=True,
+                can_send_video_notes=True,
+                can_send_voice_notes=True,
+                can_send_polls=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True
+            )
+        await bot.set_chat_permissions(chat_id, permissions)
+
     async def restrict_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """⚠️ Restrict user permissions"""
         if not await self.is_admin(update, context):
@@ -1648,13 +4330,16 @@ Choose a category to explore:
             await update.message.reply_text("❌ You need admin privileges to detect spam.")
             return
         
+        footprint = self.anti_spam.footprint()
         await update.message.reply_text(
             "🔍 **Spam Detection Analysis**\n\n"
             f"🛡️ **Current Status:**\n"
             f"• Anti-spam system: ✅ Active\n"
             f"• Messages scanned: {self.stats['messages_filtered']:,}\n"
             f"• Spam blocked: {self.stats['spam_blocked']:,}\n"
-            f"• Detection rate: {(self.stats['spam_blocked'] / max(self.stats['messages_filtered'], 1) * 100):.1f}%\n\n"
+            f"• Detection rate: {(self.stats['spam_blocked'] / max(self.stats['messages_filtered'], 1) * 100):.1f}%\n"
+            f"• Filter cache hits: {self.content_filter.verdict_cache_stats()['hit_rate'] * 100:.1f}%\n"
+            f"• Users tracked: {footprint['tracked_users']:,} (~{footprint['approx_bytes'] // 1024:,} KB)\n\n"
             f"📊 **Recent Activity:**\n"
             f"• System is monitoring all messages\n"
             f"• Advanced pattern recognition active\n"
@@ -1673,13 +4358,9 @@ Choose a category to explore:
             return
         
         status = context.args[0].lower()
-        chat_key = str(update.effective_chat.id)
-        
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {"settings": {}}
-        
-        self.groups_data[chat_key]["settings"]["anti_spam_enabled"] = (status == "on")
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["settings"]["anti_spam_enabled"] = (status == "on")
+        self.save_group_settings(update.effective_chat.id, group)
         
         status_text = "✅ Enabled" if status == "on" else "❌ Disabled"
         await update.message.reply_text(
@@ -1689,23 +4370,171 @@ Choose a category to explore:
             parse_mode=ParseMode.MARKDOWN
         )
 
+    async def spampolicy_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """🎚️ Show or tune the group's anti-spam thresholds"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ You need admin privileges to change the spam policy.")
+            return
+        
+        settings = {
+            'messages': ('max_messages_per_minute', int),
+            'identical': ('max_identical_messages', int),
+            'links': ('max_links_per_message', int),
+            'duplicates': ('near_duplicate_users', int),
+            'copies': ('duplicate_content_users', int),
+            'caps': ('caps_ratio', float),
+            'sensitivity': ('spam_detection_sensitivity', str),
+        }
+        chat_id = update.effective_chat.id
+        group = self.get_group_settings(chat_id)
+        overrides = group.setdefault("anti_spam", {})
+        
+        if context.args and context.args[0].lower() == "reset":
+            overrides.clear()
+            self.save_group_settings(chat_id, group)
+            self.anti_spam.invalidate_policy(str(chat_id))
+        elif context.args:
+            name = context.args[0].lower()
+            if name not in settings or len(context.args) < 2:
+                await update.message.reply_text(
+                    f"❌ Usage: /spampolicy <{'|'.join(settings)}> <value>\n"
+                    "or /spampolicy reset"
+                )
+                return
+            key, convert = settings[name]
+            try:
+                value = convert(context.args[1].lower())
+            except ValueError:
+                await update.message.reply_text(f"❌ Invalid value for {name}: {context.args[1]}")
+                return
+            if key == 'spam_detection_sensitivity' and value not in SpamPolicy.SENSITIVITY:
+                await update.message.reply_text("❌ Sensitivity must be low, medium or high")
+                return
+            if key == 'caps_ratio' and not 0 < value <= 1:
+                await update.message.reply_text("❌ Caps ratio must be between 0 and 1")
+                return
+            if convert is int and value < 1:
+                await update.message.reply_text(f"❌ {name} must be at least 1")
+                return
+            cap = self.anti_spam.countable_limits().get(key)
+            if cap is not None and value > cap:
+                await update.message.reply_text(f"❌ {name} can be at most {cap}")
+                return
+            overrides[key] = value
+            self.save_group_settings(chat_id, group)
+            self.anti_spam.invalidate_policy(str(chat_id))
+        
+        policy = self.anti_spam.group_policy(str(chat_id), group)
+        await update.message.reply_text(
+            f"🎚️ **Anti-Spam Policy**\n\n"
+            f"• Messages per minute: {policy.max_messages_per_minute}\n"
+            f"• Identical messages: {policy.max_identical_messages}\n"
+            f"• Links per message: {policy.max_links_per_message}\n"
+            f"• Near-duplicate senders: {policy.near_duplicate_users}\n"
+            f"• Same-content senders: {policy.duplicate_content_users}\n"
+            f"• Caps ratio: {policy.caps_ratio:.2f}\n"
+            f"• Sensitivity: {policy.sensitivity} (flags at score {policy.spam_score})\n\n"
+            f"{'⚙️ Custom settings for this group' if overrides else '🌐 Using global defaults'}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
     async def antiflood_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """🌊 Toggle anti-flood protection"""
         if not await self.is_admin(update, context):
             await update.message.reply_text("❌ You need admin privileges to toggle anti-flood.")
             return
         
-        if not context.args or context.args[0].lower() not in ['on', 'off']:
-            await update.message.reply_text("❌ Usage: /antiflood <on|off>")
+        usage = (
+            f"❌ Usage: /antiflood <on|off> [limit] [window seconds] [{'|'.join(self.FLOOD_ACTIONS)}]\n"
+            "or /antiflood chat <limit|off> [window seconds]"
+        )
+        if not context.args or context.args[0].lower() not in ['on', 'off', 'chat']:
+            await update.message.reply_text(usage)
             return
         
         status = context.args[0].lower()
+        if status == "chat":
+            # Chat-wide limit: /antiflood chat <limit|off> [window]
+            changes: Dict[str, Any] = {}
+            try:
+                if len(context.args) < 2:
+                    raise ValueError
+                changes["chat_limit"] = 0 if context.args[1].lower() == "off" else int(context.args[1])
+                if len(context.args) > 2:
+                    changes["chat_window"] = int(context.args[2])
+            except ValueError:
+                await update.message.reply_text(usage)
+                return
+            if changes["chat_limit"] < 0 or changes.get("chat_window", 1) < 1:
+                await update.message.reply_text(usage)
+                return
+        else:
+            changes = {"enabled": status == "on"}
+            try:
+                if len(context.args) > 1:
+                    changes["limit"] = int(context.args[1])
+                if len(context.args) > 2:
+                    changes["window"] = int(context.args[2])
+            except ValueError:
+                await update.message.reply_text(usage)
+                return
+            if len(context.args) > 3:
+                changes["action"] = context.args[3].lower()
+            if changes.get("limit", 1) < 1 or changes.get("window", 1) < 1 or changes.get("action", "mute") not in self.FLOOD_ACTIONS:
+                await update.message.reply_text(usage)
+                return
         
-        status_text = "✅ Enabled" if status == "on" else "❌ Disabled"
+        group = self.get_group_settings(update.effective_chat.id)
+        group.setdefault("antiflood", {}).update(changes)
+        self.save_group_settings(update.effective_chat.id, group)
+        flood = self.get_flood_settings(group)
+        
+        status_text = "✅ Enabled" if flood["enabled"] else "❌ Disabled"
+        chat_limit_text = (f"{flood['chat_limit']} messages per {flood['chat_window']}s"
+                           if flood["chat_limit"] else "no limit")
         await update.message.reply_text(
             f"🌊 **Anti-Flood Protection**\n\n"
             f"Status: {status_text}\n"
-            f"🔧 Flood detection and prevention active\n"
+            f"📊 Limit: {flood['limit']} messages per {flood['window']}s\n"
+            f"⚡ Action: {flood['action'].title()}\n"
+            f"👥 Whole group: {chat_limit_text}\n"
+            f"👮‍♂️ Changed by: {update.effective_user.first_name}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def antiraid_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """🚨 Configure join-burst raid protection"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ You need admin privileges to configure raid protection.")
+            return
+        
+        usage = "❌ Usage: /antiraid <on|off> [joins] [window seconds] [lockdown minutes]"
+        if not context.args or context.args[0].lower() not in ['on', 'off']:
+            await update.message.reply_text(usage)
+            return
+        
+        changes: Dict[str, Any] = {"enabled": context.args[0].lower() == "on"}
+        try:
+            for key, value in zip(("join_limit", "window", "lockdown_minutes"), context.args[1:]):
+                changes[key] = int(value)
+        except ValueError:
+            await update.message.reply_text(usage)
+            return
+        if any(value < 1 for key, value in changes.items() if key != "enabled"):
+            await update.message.reply_text(usage)
+            return
+        
+        group = self.get_group_settings(update.effective_chat.id)
+        group.setdefault("antiraid", {}).update(changes)
+        self.save_group_settings(update.effective_chat.id, group)
+        raid = self.get_raid_settings(group)
+        
+        status_text = "✅ Enabled" if raid["enabled"] else "❌ Disabled"
+        await update.message.reply_text(
+            f"🚨 **Raid Protection**\n\n"
+            f"Status: {status_text}\n"
+            f"👥 Lockdown after {raid['join_limit']} joins in {raid['window']}s\n"
+            f"⏱️ Lockdown lasts {raid['lockdown_minutes']} minutes\n"
             f"👮‍♂️ Changed by: {update.effective_user.first_name}",
             parse_mode=ParseMode.MARKDOWN
         )
@@ -1716,21 +4545,24 @@ Choose a category to explore:
             await update.message.reply_text("❌ You need admin privileges to view logs.")
             return
         
-        log_file = self.data_dir / "actions.log"
-        
-        if not log_file.exists():
-            await update.message.reply_text("📜 No recent actions logged.")
-            return
+        count = 10  # Default number of actions
+        if context.args:
+            try:
+                count = max(1, min(int(context.args[0]), 50))  # Max 50 actions
+            except ValueError:
+                pass
         
         try:
-            with open(log_file, 'r') as f:
-                lines = f.readlines()[-10:]  # Last 10 actions
+            entries = await asyncio.to_thread(self.action_logger.recent, update.effective_chat.id, count)
+            
+            if not entries:
+                await update.message.reply_text("📜 No recent actions logged.")
+                return
             
             log_text = "📜 **Recent Group Actions:**\n\n"
             
-            for line in lines:
+            for entry in entries:
                 try:
-                    entry = json.loads(line)
                     timestamp = datetime.fromisoformat(entry['timestamp']).strftime('%m-%d %H:%M')
                     action = entry['action'].title()
                     log_text += f"• {timestamp} - {action}\n"
@@ -1873,13 +4705,9 @@ Choose a category to explore:
             return
         
         status = context.args[0].lower()
-        chat_key = str(update.effective_chat.id)
-        
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {"settings": {}}
-        
-        self.groups_data[chat_key]["settings"]["check_adult_content"] = (status == "on")
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["settings"]["check_adult_content"] = (status == "on")
+        self.save_group_settings(update.effective_chat.id, group)
         
         status_text = "✅ Enabled" if status == "on" else "❌ Disabled"
         await update.message.reply_text(
@@ -1912,6 +4740,154 @@ Choose a category to explore:
             parse_mode=ParseMode.MARKDOWN
         )
 
+    async def _check_filter_edit(self, update: Update, context: ContextTypes.DEFAULT_TYPE, usage: str) -> bool:
+        """Common admin and argument checks for the filter list commands"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ You need admin privileges to edit content filters.")
+            return False
+        
+        if not context.args:
+            await update.message.reply_text(f"❌ Usage: {usage}")
+            return False
+        
+        return True
+
+    def _update_group_list(self, chat_id: int, list_name: str, add: bool, values: List[str]) -> List[str]:
+        """Add or remove entries in a group filter list; returns the changed entries"""
+        if list_name == "banned_words":
+            entries = [word.lower() for word in values]
+        else:
+            entries = [normalize_domain(domain) for domain in values]
+        entries = [entry for entry in entries if entry]
+        
+        group = self.get_group_settings(chat_id)
+        current = group.setdefault(list_name, [])
+        if add:
+            changed = [entry for entry in dict.fromkeys(entries) if entry not in current]
+            current.extend(changed)
+        else:
+            changed = [entry for entry in entries if entry in current]
+            group[list_name] = [entry for entry in current if entry not in changed]
+        
+        if changed:
+            self.save_group_settings(chat_id, group)
+            self.content_filter.invalidate_group(str(chat_id))
+        return changed
+
+    async def addword_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """🚫 Add words to the group's banned list"""
+        if not await self._check_filter_edit(update, context, "/addword <word> [word...]"):
+            return
+        
+        added = self._update_group_list(update.effective_chat.id, "banned_words", True, context.args)
+        if not added:
+            await update.message.reply_text("ℹ️ Those words are already banned.")
+            return
+        
+        await update.message.reply_text(
+            f"🚫 **Banned Words Added**\n\n"
+            f"📝 Words: {', '.join(added)}\n"
+            f"👮‍♂️ By: {update.effective_user.first_name}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def delword_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """✅ Remove words from the group's banned list"""
+        if not await self._check_filter_edit(update, context, "/delword <word> [word...]"):
+            return
+        
+        removed = self._update_group_list(update.effective_chat.id, "banned_words", False, context.args)
+        if not removed:
+            await update.message.reply_text("ℹ️ None of those words are banned.")
+            return
+        
+        await update.message.reply_text(
+            f"✅ **Banned Words Removed**\n\n"
+            f"📝 Words: {', '.join(removed)}\n"
+            f"👮‍♂️ By: {update.effective_user.first_name}",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    async def bannedwords_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """📋 Show the group's banned words"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ You need admin privileges to view content filters.")
+            return
+        
+        words = self.get_group_settings(update.effective_chat.id).get("banned_words", [])
+        if not words:
+            await update.message.reply_text("📋 No banned words set for this group.\n💡 Add some with /addword")
+            return
+        
+        await update.message.reply_text(
+            f"🚫 Banned Words ({len(words)}):\n\n" + ", ".join(words)
+        )
+
+    async def blockdomain_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """⛔ Block links to domains in this group"""
+        if not await self._check_filter_edit(update, context, "/blockdomain <domain> [domain...]"):
+            return
+        
+        added = self._update_group_list(update.effective_chat.id, "blocked_domains", True, context.args)
+        if not added:
+            await update.message.reply_text("ℹ️ Those domains are already blocked.")
+            return
+        
+        await update.message.reply_text(
+            f"⛔ Domains Blocked\n\n"
+            f"🌐 Domains: {', '.join(added)}\n"
+            f"👮‍♂️ By: {update.effective_user.first_name}"
+        )
+
+    async def allowdomain_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """✅ Always allow links to domains in this group"""
+        if not await self._check_filter_edit(update, context, "/allowdomain <domain> [domain...]"):
+            return
+        
+        added = self._update_group_list(update.effective_chat.id, "allowed_domains", True, context.args)
+        if not added:
+            await update.message.reply_text("ℹ️ Those domains are already allowed.")
+            return
+        
+        await update.message.reply_text(
+            f"✅ Domains Allowed\n\n"
+            f"🌐 Domains: {', '.join(added)}\n"
+            f"👮‍♂️ By: {update.effective_user.first_name}"
+        )
+
+    async def deldomain_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """🗑️ Remove domains from the group's allow and block lists"""
+        if not await self._check_filter_edit(update, context, "/deldomain <domain> [domain...]"):
+            return
+        
+        chat_id = update.effective_chat.id
+        removed = self._update_group_list(chat_id, "blocked_domains", False, context.args)
+        removed += self._update_group_list(chat_id, "allowed_domains", False, context.args)
+        if not removed:
+            await update.message.reply_text("ℹ️ None of those domains are listed.")
+            return
+        
+        await update.message.reply_text(
+            f"🗑️ Domains Removed\n\n"
+            f"🌐 Domains: {', '.join(dict.fromkeys(removed))}\n"
+            f"👮‍♂️ By: {update.effective_user.first_name}"
+        )
+
+    async def domains_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """🌐 Show the group's domain lists"""
+        if not await self.is_admin(update, context):
+            await update.message.reply_text("❌ You need admin privileges to view content filters.")
+            return
+        
+        group = self.get_group_settings(update.effective_chat.id)
+        blocked = group.get("blocked_domains", [])
+        allowed = group.get("allowed_domains", [])
+        
+        domains_text = "🌐 Domain Filters\n\n"
+        domains_text += f"⛔ Blocked ({len(blocked)}): {', '.join(blocked) or 'none'}\n"
+        domains_text += f"✅ Allowed ({len(allowed)}): {', '.join(allowed) or 'none'}"
+        await update.message.reply_text(domains_text)
+
     # ======================== STORAGE & EXPORT ========================
     
     async def backup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1923,7 +4899,7 @@ Choose a category to explore:
         try:
             chat_key = str(update.effective_chat.id)
             backup_data = {
-                "group_settings": self.groups_data.get(chat_key, {}),
+                "group_settings": self.get_group_settings(update.effective_chat.id),
                 "bot_config": self.config,
                 "export_date": datetime.now().isoformat(),
                 "group_id": update.effective_chat.id,
@@ -1983,12 +4959,10 @@ Choose a category to explore:
         try:
             csv_data = "User ID,Username,First Name,Roles\n"
             
-            for user_key, user_data in self.users_data.items():
-                if user_key.startswith(str(update.effective_chat.id)):
-                    user_id = user_key.split('_')[1]
-                    roles = ','.join(user_data.get('roles', []))
-                    if roles:
-                        csv_data += f"{user_id},,Unknown,{roles}\n"
+            for user_id, user_roles in self.storage.iter_roles(update.effective_chat.id):
+                roles = ','.join(user_roles)
+                if roles:
+                    csv_data += f"{user_id},,Unknown,{roles}\n"
             
             if csv_data == "User ID,Username,First Name,Roles\n":
                 await update.message.reply_text("📄 No roles to export in this group.")
@@ -2120,9 +5094,17 @@ We're here to help! 🇵🇸
 • /setwelcome <text> - 🎉 Set welcome message
 • /setgoodbye <text> - 👋 Set goodbye message
 • /antispam on|off - 🛡️ Toggle anti-spam
-• /antiflood on|off - 🌊 Toggle anti-flood
+• /spampolicy [setting value] - 🎚️ Tune anti-spam
+• /antiflood on|off [limit] [window] [action] - 🌊 Toggle anti-flood
+• /antiflood chat <limit|off> [window] - 👥 Group-wide rate limit
+• /antiraid on|off [joins] [window] [minutes] - 🚨 Raid lockdown
 • /antinsfw on|off - 🚫 Toggle adult content filter
 • /antilink on|off - 🔗 Toggle link filtering
+• /addword /delword <words> - 🚫 Edit banned words
+• /bannedwords - 📋 Show banned words
+• /blockdomain /allowdomain <domains> - 🌐 Edit domain lists
+• /deldomain <domains> - 🗑️ Unlist domains
+• /domains - 🌐 Show domain lists
 
 👥 **Member Management:**
 • /addrole <role> [reply] - 🎭 Assign role to user
@@ -2225,12 +5207,9 @@ Need help? Use /contactadmin for direct support! 🇵🇸
             await update.message.reply_text("❌ Unsupported language code.")
             return
         
-        chat_key = str(update.effective_chat.id)
-        if chat_key not in self.groups_data:
-            self.groups_data[chat_key] = {"settings": {}}
-        
-        self.groups_data[chat_key]["settings"]["language"] = lang_code
-        self.save_json_file("groups.json", self.groups_data)
+        group = self.get_group_settings(update.effective_chat.id)
+        group["settings"]["language"] = lang_code
+        self.save_group_settings(update.effective_chat.id, group)
         
         await update.message.reply_text(
             f"🌐 **Language Updated**\n\n"
@@ -2248,9 +5227,13 @@ Need help? Use /contactadmin for direct support! 🇵🇸
         try:
             # Reload all configuration files
             self.config = self.load_config()
-            self.groups_data = self.load_json_file("groups.json", {})
-            self.users_data = self.load_json_file("users.json", {})
-            self.warnings_data = self.load_json_file("warnings.json", {})
+            self.anti_spam.configure(self.config.get("anti_spam", {}))
+            self.group_cache.clear()
+            self.storage.reload()
+            self.content_filter.invalidate_all_groups()
+            # Build and map off the loop, swap on it: handlers may be mid-lookup
+            # in the old blocklist, which set_blocklist closes
+            self.content_filter.set_blocklist(await asyncio.to_thread(self.open_blocklist))
             
             await update.message.reply_text(
                 "🔄 **Configuration Reloaded Successfully!**\n\n"
@@ -2353,12 +5336,7 @@ Need help? Use /contactadmin for direct support! 🇵🇸
             "chat_id": chat_id
         }
         
-        log_file = self.data_dir / "actions.log"
-        try:
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(log_entry) + '\n')
-        except Exception as e:
-            logger.error(f"Failed to log action: {e}")
+        self.action_logger.log(log_entry)
 
     # ======================== CALLBACK QUERY HANDLERS ========================
     
@@ -2709,14 +5687,41 @@ Use the buttons below to access specific settings:
         # Get group settings
         group_settings = self.get_group_settings(update.effective_chat.id)
         
+        # Flood control comes first: it is the cheapest check
+        flood = self.get_flood_settings(group_settings)
+        if flood["enabled"]:
+            allowed, level = await self._state_call(
+                self.state.hit_window,
+                f"flood:{update.effective_chat.id}:{user.id}", flood["limit"], flood["window"]
+            )
+            if not allowed:
+                await self._handle_flood(update, context, flood, level)
+                return
+            # ...and on the chat as a whole, whoever is sending
+            if flood["chat_limit"]:
+                allowed, level = await self._state_call(
+                    self.state.hit_window,
+                    f"flood:{update.effective_chat.id}", flood["chat_limit"], flood["chat_window"]
+                )
+                if not allowed:
+                    await self._handle_chat_flood(update, context, flood, level)
+                    return
+        
+        # Analyse the message once for both the content filter and anti-spam
+        features = MessageFeatures.from_message(message)
+        
         # Content filtering
         if group_settings["settings"].get("content_filtering_enabled", True):
-            if message.text:
+            if features.text or features.links:
                 content_result = self.content_filter.check_content(
-                    message.text,
+                    features.text,
                     check_adult=self.config["content_filtering"]["check_adult_content"],
                     check_profanity=self.config["content_filtering"]["check_profanity"],
-                    check_harassment=self.config["content_filtering"]["check_harassment"]
+                    check_harassment=self.config["content_filtering"]["check_harassment"],
+                    normalized=features.normalized,
+                    group_rules=self.content_filter.group_rules(str(update.effective_chat.id), group_settings),
+                    urls=features.links,
+                    text_hash=features.text_hash
                 )
                 
                 if not content_result["is_safe"]:
@@ -2725,7 +5730,10 @@ Use the buttons below to access specific settings:
         
         # Anti-spam check
         if group_settings["settings"].get("anti_spam_enabled", True):
-            spam_result = self.anti_spam.check_spam(user.id, message)
+            spam_result = self.anti_spam.check_spam(
+                update.effective_chat.id, user.id, features,
+                self.anti_spam.group_policy(str(update.effective_chat.id), group_settings)
+            )
             
             if spam_result["is_spam"]:
                 await self._handle_spam_violation(update, context, spam_result)
@@ -2736,7 +5744,7 @@ Use the buttons below to access specific settings:
         try:
             # Delete the message
             await update.message.delete()
-            self.stats["messages_filtered"] += 1
+            self.stats.incr("messages_filtered")
             
             # Send warning
             violation_text = f"🚨 **Content Violation Detected**\n\n"
@@ -2775,7 +5783,7 @@ Use the buttons below to access specific settings:
         try:
             # Delete the message
             await update.message.delete()
-            self.stats["spam_blocked"] += 1
+            self.stats.incr("spam_blocked")
             
             # Take action based on spam score
             action_taken = "Message deleted"
@@ -2817,6 +5825,95 @@ Use the buttons below to access specific settings:
         except Exception as e:
             logger.error(f"Error handling spam violation: {e}")
 
+    async def _handle_flood(self, update: Update, context: ContextTypes.DEFAULT_TYPE, flood: Dict, level: float):
+        """Delete flood messages; act on the user once, when they first cross the limit"""
+        chat_id = update.effective_chat.id
+        user = update.effective_user
+        try:
+            await update.message.delete()
+        except TelegramError:
+            pass
+        self.stats.incr("spam_blocked")
+        
+        if level - 1 > flood["limit"]:
+            return  # already handled this burst
+        
+        action = flood["action"]
+        action_taken = "Messages deleted"
+        try:
+            if action == "mute":
+                await context.bot.restrict_chat_member(
+                    chat_id, user.id,
+                    permissions=ChatPermissions(can_send_messages=False),
+                    until_date=datetime.now() + timedelta(minutes=5)
+                )
+                action_taken = "User muted for 5 minutes"
+            elif action == "kick":
+                await context.bot.ban_chat_member(chat_id, user.id)
+                await context.bot.unban_chat_member(chat_id, user.id)
+                action_taken = "User kicked"
+            elif action == "ban":
+                await context.bot.ban_chat_member(chat_id, user.id)
+                action_taken = "User banned"
+            elif action == "warn":
+                warn_count, banned = await self._add_warning(context.bot, chat_id, user.id, {
+                    "reason": "Flooding",
+                    "date": datetime.now().isoformat(),
+                    "warned_by": 0,
+                    "warned_by_name": "Anti-Flood"
+                })
+                action_taken = f"User warned ({warn_count}/{self.config['warn_limit']})"
+                if banned:
+                    action_taken += ", limit reached: banned"
+        except TelegramError as e:
+            logger.error(f"Error applying flood action: {e}")
+        
+        self._log_action(chat_id, "antiflood", 0, user.id, action_taken)
+        
+        # A few notices per minute per chat at most, however many users flood
+        if not self.notice_limiter.hit(chat_id, 3, 60)[0]:
+            return
+        try:
+            notice = await context.bot.send_message(
+                chat_id,
+                f"🌊 **Flood Detected**\n\n"
+                f"👤 User: {user.first_name}\n"
+                f"📊 Limit: {flood['limit']} messages per {flood['window']}s\n"
+                f"⚡ Action: {action_taken}",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            await asyncio.sleep(10)
+            await notice.delete()
+        except TelegramError:
+            pass
+
+    async def _handle_chat_flood(self, update: Update, context: ContextTypes.DEFAULT_TYPE, flood: Dict, level: float):
+        """Delete messages over the chat-wide limit; nobody is punished for a busy chat"""
+        chat_id = update.effective_chat.id
+        try:
+            await update.message.delete()
+        except TelegramError:
+            pass
+        
+        if level - 1 > flood["chat_limit"]:
+            return  # already announced this burst
+        
+        self._log_action(chat_id, "antiflood_chat", 0, 0, f"over {flood['chat_limit']} messages per {flood['chat_window']}s")
+        if not self.notice_limiter.hit(chat_id, 3, 60)[0]:
+            return
+        try:
+            notice = await context.bot.send_message(
+                chat_id,
+                f"🌊 **Chat Flood Detected**\n\n"
+                f"📊 Limit: {flood['chat_limit']} messages per {flood['chat_window']}s for the whole group\n"
+                f"⚡ Action: Messages over the limit are deleted",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            await asyncio.sleep(10)
+            await notice.delete()
+        except TelegramError:
+            pass
+
     # ======================== NEW MEMBER HANDLER ========================
     
     async def handle_new_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2826,6 +5923,33 @@ Use the buttons below to access specific settings:
         
         chat = update.effective_chat
         group_settings = self.get_group_settings(chat.id)
+        joiners = [member for member in update.message.new_chat_members if not member.is_bot]
+        
+        # Count joins; a burst puts the chat in lockdown
+        raid = self.get_raid_settings(group_settings)
+        in_lockdown = await self._state_call(self.state.get, f"lockdown:{chat.id}") is not None
+        if raid["enabled"] and joiners and not in_lockdown:
+            for _ in joiners:
+                allowed, _level = await self._state_call(
+                    self.state.hit_window, f"joins:{chat.id}", raid["join_limit"], raid["window"]
+                )
+            if not allowed:
+                await self._start_lockdown(context, chat.id, raid, len(joiners))
+                in_lockdown = True
+        
+        # During a lockdown joiners are muted and never welcomed
+        if in_lockdown:
+            until = datetime.now() + timedelta(minutes=raid["lockdown_minutes"])
+            for new_member in joiners:
+                try:
+                    await context.bot.restrict_chat_member(
+                        chat.id, new_member.id,
+                        permissions=ChatPermissions(can_send_messages=False),
+                        until_date=until
+                    )
+                except TelegramError as e:
+                    logger.error(f"Failed to restrict raid joiner: {e}")
+            return
         
         if not group_settings["settings"].get("welcome_enabled", True):
             return
@@ -2859,6 +5983,63 @@ Use the buttons below to access specific settings:
             except Exception as e:
                 logger.error(f"Failed to send welcome message: {e}")
 
+    async def _start_lockdown(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, raid: Dict, joins: int) -> None:
+        """Lock the chat for the cooldown and schedule the automatic unlock"""
+        duration = raid["lockdown_minutes"] * 60
+        key = f"lockdown:{chat_id}"
+        if await self._state_call(self.state.get, key) is not None:
+            return  # another join update started it while this one was counting
+        marker = {"until": time.time() + duration, "permissions": None}
+        # Set before calling Telegram so joins arriving meanwhile see the lockdown
+        await self._state_call(self.state.set, key, marker)
+        try:
+            # Remember what the chat allowed (a manual /lock, no media, ...) to restore it after
+            chat = await context.bot.get_chat(chat_id)
+            if chat.permissions is not None and await self._state_call(self.state.get, key) is not None:
+                marker["permissions"] = chat.permissions.to_dict()
+                await self._state_call(self.state.set, key, marker)
+        except TelegramError as e:
+            logger.error(f"Failed to read permissions of chat {chat_id} before lockdown: {e}")
+        try:
+            await self._set_chat_locked(context.bot, chat_id, True)
+            await context.bot.send_message(
+                chat_id,
+                f"🚨 **Raid Detected**\n\n"
+                f"👥 More than {raid['join_limit']} joins in {raid['window']}s\n"
+                f"🔒 Group locked for {raid['lockdown_minutes']} minutes\n"
+                f"🔇 New members are muted and not welcomed",
+                parse_mode=ParseMode.MARKDOWN
+            )
+        except TelegramError as e:
+            logger.error(f"Failed to lock chat {chat_id} during raid: {e}")
+        self._log_action(chat_id, "raid_lockdown", 0, 0, f"{joins} joins, locked for {raid['lockdown_minutes']} min")
+        self._lockdown_tasks[chat_id] = asyncio.create_task(self._lift_lockdown(context.bot, chat_id, duration))
+
+    async def _lift_lockdown(self, bot, chat_id: int, delay: float) -> None:
+        """Restore the chat's permissions once the raid cooldown has passed"""
+        try:
+            await asyncio.sleep(delay)
+            key = f"lockdown:{chat_id}"
+            marker = await self._state_call(self.state.get, key)
+            # Removing the marker is the claim: only one worker (or /unlock) lifts it
+            if not await self._state_call(self.state.delete, key):
+                return
+            saved = marker.get("permissions") if isinstance(marker, dict) else None
+            if saved is not None:
+                await bot.set_chat_permissions(chat_id, ChatPermissions.de_json(saved, bot))
+            else:
+                await self._set_chat_locked(bot, chat_id, False)
+            await bot.send_message(
+                chat_id,
+                "🔓 **Raid Lockdown Lifted**\n\n✅ The group's previous permissions are restored.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            self._log_action(chat_id, "raid_lockdown_lifted", 0, 0)
+        except TelegramError as e:
+            logger.error(f"Failed to lift lockdown in chat {chat_id}: {e}")
+        finally:
+            self._lockdown_tasks.pop(chat_id, None)
+
     async def handle_left_member(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle members leaving"""
         if not update.message or not update.message.left_chat_member:
@@ -2945,7 +6126,9 @@ Use the buttons below to access specific settings:
         application.add_handler(CommandHandler("restrict", self.restrict_command))
         application.add_handler(CommandHandler("detectspam", self.detectspam_command))
         application.add_handler(CommandHandler("antispam", self.antispam_command))
+        application.add_handler(CommandHandler("spampolicy", self.spampolicy_command))
         application.add_handler(CommandHandler("antiflood", self.antiflood_command))
+        application.add_handler(CommandHandler("antiraid", self.antiraid_command))
         application.add_handler(CommandHandler("log", self.log_command))
         
         # Member management handlers
@@ -2957,6 +6140,13 @@ Use the buttons below to access specific settings:
         # Content filtering handlers
         application.add_handler(CommandHandler("antinsfw", self.antinsfw_command))
         application.add_handler(CommandHandler("antilink", self.antilink_command))
+        application.add_handler(CommandHandler("addword", self.addword_command))
+        application.add_handler(CommandHandler("delword", self.delword_command))
+        application.add_handler(CommandHandler("bannedwords", self.bannedwords_command))
+        application.add_handler(CommandHandler("blockdomain", self.blockdomain_command))
+        application.add_handler(CommandHandler("allowdomain", self.allowdomain_command))
+        application.add_handler(CommandHandler("deldomain", self.deldomain_command))
+        application.add_handler(CommandHandler("domains", self.domains_command))
         
         # Storage & Export handlers
         application.add_handler(CommandHandler("backup", self.backup_command))
@@ -3039,7 +6229,7 @@ async def async_main():
         bot = GroupMegBot()
         
         # Create application
-        application = Application.builder().token(BOT_TOKEN).build()
+        application = Application.builder().token(BOT_TOKEN).post_init(bot.post_init).build()
         
         # Setup handlers
         bot.setup_handlers(application)
@@ -3071,9 +6261,12 @@ async def async_main():
         # Cleanup
         if 'application' in locals():
             await application.shutdown()
+        if 'bot' in locals():
+            bot.shutdown()
 
 def main():
     """Main function to run the bot with proper event loop"""
+    log_listener = setup_logging()
     try:
         # Create new event loop if none exists
         try:
@@ -3090,6 +6283,9 @@ def main():
     except Exception as e:
         logger.error(f"❌ Failed to start bot: {e}")
         raise
+    finally:
+        # Drain queued log records before exit
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-message analysis cost before and after MessageFeatures
+
+Both paths run the real ContentFilter.check_content on real telegram
+Message objects. "before" is the old per-check extraction: the content
+filter normalizes the raw text and is handed URLs parsed from the
+entities, and the anti-spam check (the pre-MessageFeatures check_spam,
+reproduced below) parses the entities again, counts capitals character by
+character and compares raw message text. "after" builds one
+MessageFeatures.from_message and feeds it to check_content and the
+current AntiSpamSystem.check_spam.
+
+The current check_spam also runs checks the old one did not have
+(near-duplicates, cross-user duplicate content), so the extraction step
+is timed on its own, and "after, same checks" runs the old set of spam
+checks against MessageFeatures for a like-for-like comparison.
+
+Usage: python scripts/bench_message_features.py [messages]
+"""
+
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Chat, Message, MessageEntity, User  # noqa: E402
+
+from group_meg_bot import (  # noqa: E402
+    URL_PATTERN, AntiSpamSystem, ContentFilter, MessageFeatures, extract_urls, hash_text, normalize_text
+)
+
+WORDS = (
+    "hey everyone the meetup is moved to saturday at 5pm does anyone know how fix build on python "
+    "lol that was hilarious see good morning all have a great day ahead check out this amazing offer "
+    "click here now free money earn thanks for sharing where did you find it i think we should ask admin "
+    "new release notes are up who is coming tonight please read pinned message before posting 😂 🌞"
+).split()
+LINKS = ["https://bit.ly/abc123", "https://example.com/watch?v=42", "https://tinyurl.com/xyz",
+         "https://example.org/docs"]
+
+
+def random_text(rng):
+    """Chat-like text: a few words, sometimes shouting, sometimes with links"""
+    text = " ".join(rng.choices(WORDS, k=rng.randint(3, 16)))
+    if rng.random() < 0.1:
+        text = text.upper()
+    if rng.random() < 0.3:
+        text += " " + " ".join(rng.sample(LINKS, rng.randint(1, 2)))
+    return text
+
+CHAT = Chat(-100, Chat.SUPERGROUP, title="Bench")
+USERS = 500
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def make_message(message_id, text, user_id):
+    """A Message with URL entities, as Telegram delivers it"""
+    entities = [
+        MessageEntity(MessageEntity.URL, utf16_len(text[:m.start()]), utf16_len(m.group()))
+        for m in URL_PATTERN.finditer(text)
+    ]
+    return Message(message_id, datetime.now(timezone.utc), CHAT,
+                   from_user=User(user_id, "U", False), text=text, entities=entities)
+
+
+class LegacySpamCheck:
+    """check_spam as it was before MessageFeatures: it re-reads the raw message"""
+
+    def __init__(self):
+        self.history = {}
+
+    def check(self, user_id, message):
+        now = datetime.now()
+        history = self.history.setdefault(user_id, [])
+        history[:] = [msg for msg in history
+                      if (now - datetime.fromisoformat(msg['timestamp'])).seconds < 3600]
+        history.append({'text': message.text or '', 'timestamp': now.isoformat(),
+                        'message_id': message.message_id})
+
+        score = 0
+        recent = [msg for msg in history if (now - datetime.fromisoformat(msg['timestamp'])).seconds < 60]
+        if len(recent) > 5:
+            score += 50
+        if message.text and sum(1 for msg in history[-10:] if msg['text'] == message.text) > 3:
+            score += 40
+        if len(extract_urls(message)) > 3:
+            score += 30
+        if message.text and len(message.text) > 10:
+            if sum(1 for c in message.text if c.isupper()) / len(message.text) > 0.7:
+                score += 20
+        return score
+
+    def check_features(self, user_id, features):
+        """The same checks, reading from MessageFeatures instead of the message"""
+        now = datetime.now()
+        history = self.history.setdefault(user_id, [])
+        history[:] = [msg for msg in history
+                      if (now - datetime.fromisoformat(msg['timestamp'])).seconds < 3600]
+        history.append({'text_hash': features.text_hash, 'timestamp': now.isoformat(),
+                        'message_id': features.message_id})
+
+        score = 0
+        recent = [msg for msg in history if (now - datetime.fromisoformat(msg['timestamp'])).seconds < 60]
+        if len(recent) > 5:
+            score += 50
+        if features.text and sum(1 for msg in history[-10:] if msg['text_hash'] == features.text_hash) > 3:
+            score += 40
+        if len(features.links) > 3:
+            score += 30
+        if features.length > 10 and features.caps_ratio > 0.7:
+            score += 20
+        return score
+
+
+def content_filter():
+    cf = ContentFilter()
+    cf.max_cached_verdicts = 0  # every message is analysed, as a unique message would be
+    cf.matcher                  # compile outside the timed loop
+    return cf
+
+
+def before(messages):
+    cf, spam = content_filter(), LegacySpamCheck()
+    for message in messages:
+        cf.check_content(message.text, urls=extract_urls(message))
+        spam.check(message.from_user.id, message)
+
+
+def after_same_checks(messages):
+    """One MessageFeatures feeding check_content and the old set of spam checks"""
+    cf, spam = content_filter(), LegacySpamCheck()
+    for message in messages:
+        features = MessageFeatures.from_message(message)
+        cf.check_content(features.text, normalized=features.normalized, urls=features.links,
+                         text_hash=features.text_hash)
+        spam.check_features(message.from_user.id, features)
+
+
+def after(messages):
+    cf, spam = content_filter(), AntiSpamSystem()
+    for message in messages:
+        features = MessageFeatures.from_message(message)
+        cf.check_content(features.text, normalized=features.normalized, urls=features.links,
+                         text_hash=features.text_hash)
+        spam.check_spam(CHAT.id, message.from_user.id, features)
+
+
+def extract_before(messages):
+    """The inputs each check used to derive for itself"""
+    for message in messages:
+        text = message.text
+        normalized = normalize_text(text)                      # content filter
+        hash_text(normalized)                                  # verdict cache key
+        extract_urls(message)                                  # content filter links
+        extract_urls(message)                                  # anti-spam links
+        sum(1 for c in text if c.isupper()) / len(text)        # anti-spam caps ratio
+
+
+def extract_after(messages):
+    for message in messages:
+        MessageFeatures.from_message(message)
+
+
+def run(label, fn, messages):
+    normalize_text.cache_clear()
+    start = time.perf_counter()
+    fn(messages)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>19}: {elapsed / len(messages) * 1e6:8.2f} µs/message")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rng = random.Random(42)
+    # Mostly unique messages so neither the normalization nor the verdict cache flatters a path
+    messages = [make_message(i, random_text(rng), rng.randrange(USERS)) for i in range(count)]
+
+    print(f"📊 Analysing {count:,} messages from {USERS} users")
+    run("extract before", extract_before, messages)
+    run("extract after", extract_after, messages)
+    run("pipeline before", before, messages)
+    run("after, same checks", after_same_checks, messages)
+    run("pipeline after", after, messages)
+
+
+if __name__ == "__main__":
+    main()
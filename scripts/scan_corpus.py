@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Scan an exported chat history with the content filter
+
+Input is JSONL, one message per line: {"id": ..., "text": "...", "urls": [...]}
+("id" and "urls" are optional). Verdicts are written as JSONL with the
+input line number, in completion order.
+
+A rules file lets you vet a change before deploying it:
+    {
+        "keywords": {"spam_indicators": ["click here", "airdrop*"]},
+        "domains": {"scam_sites": ["bit.ly"]},
+        "banned_words": ["crypto"],
+        "blocked_domains": ["example.net"],
+        "allowed_domains": ["docs.example.net"],
+        "checks": {"check_profanity": false}
+    }
+
+Usage: python scripts/scan_corpus.py history.jsonl verdicts.jsonl [--rules rules.json]
+                                     [--workers N] [--chunk-size N] [--unsafe-only]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from group_meg_bot import scan_corpus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-scan messages with the GROUP MEG content filter")
+    parser.add_argument("input", type=Path, help="JSONL file of messages")
+    parser.add_argument("output", type=Path, help="JSONL file to write verdicts to")
+    parser.add_argument("--rules", type=Path, help="JSON rules file to scan with")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="messages per worker task")
+    parser.add_argument("--unsafe-only", action="store_true", help="only write flagged messages")
+    args = parser.parse_args()
+
+    rules = {}
+    if args.rules:
+        with open(args.rules, 'r', encoding='utf-8') as f:
+            rules = json.load(f)
+
+    start = time.perf_counter()
+    totals = scan_corpus(args.input, args.output, rules=rules, workers=args.workers,
+                         chunk_size=args.chunk_size, unsafe_only=args.unsafe_only)
+    elapsed = time.perf_counter() - start
+
+    print(f"✅ Scanned {totals['scanned']:,} messages in {elapsed:.1f}s "
+          f"({totals['scanned'] / max(elapsed, 1e-9):,.0f}/s)")
+    print(f"🚫 Flagged: {totals['flagged']:,}")
+    if totals["errors"]:
+        print(f"⚠️ Unreadable lines: {totals['errors']:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import pytest
+
+from group_meg_bot import ContentFilter, normalize_text
+
+
+@pytest.fixture(scope="module")
+def content_filter():
+    return ContentFilter()
+
+
+@pytest.mark.parametrize("text", [
+    "I just bought a Samsung Galaxy A55",
+    "Model D13 is out",
+    "5ex street",
+    "flight MH17 lands at 10am",
+])
+def test_codes_and_numbers_are_not_flagged(content_filter, text):
+    assert content_filter.check_content(text)["violations"] == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Samsung Galaxy A55", "samsung galaxy a55"),
+    ("Model D13", "model d13"),
+    ("5ex street", "5ex street"),
+    ("sh1t", "shit"),
+    ("$hit", "shit"),
+    ("@ss", "ass"),
+    ("s3x", "sex"),
+    ("f u c k", "fuck"),
+])
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+@pytest.mark.parametrize("text", ["sh1t", "s.e.x", "@ss"])
+def test_disguised_words_are_flagged(content_filter, text):
+    assert content_filter.check_content(text)["violations"]